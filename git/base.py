@@ -1,11 +1,33 @@
+import contextlib
 import hashlib
+import tempfile
 import zlib
 import os
+import stat
 from object import GitBlob, GitTree, GitCommit
+from compress import blob_compression_level
+from lockfile import fsync_dir
+from pack import pack_has, pack_read, pack_header, pack_stream, inflate_chunks
 
 
-def object_read(repo, sha):
+# Files are hashed and compressed in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def object_read_raw(repo, sha):
+    """Read an object, returning its type and content
+
+    Loose objects are tried first; objects that only live in a packfile are
+    looked up through the pack indexes. The content is a bytes-like buffer
+    (bytes or memoryview) and is not copied out of the inflated object.
+    """
     path = repo.repo_path("objects", sha[0:2], sha[2:])
+    if not os.path.exists(path):
+        result = pack_read(repo, sha)
+        if result is None:
+            raise Exception(f"Object {sha} not found")
+        return result
+
     with open(path, "rb") as f:
         raw = zlib.decompress(f.read())
 
@@ -13,31 +35,239 @@ def object_read(repo, sha):
     fmt = raw[0:x]
     y = raw.find(b"\x00", x)
     size = int(raw[x + 1 : y])
-    content = raw[y + 1 :]
+    # A view rather than a slice, so the content is not copied a second time
+    content = memoryview(raw)[y + 1 :]
 
     if size != len(content):
         raise Exception("Malformed object")
 
+    return fmt, content
+
+
+def _loose_header(chunks):
+    """Split the header off an inflated loose object
+
+    Returns (fmt, size, content bytes that followed the header).
+    """
+    header = b""
+    for chunk in chunks:
+        header += chunk
+        nul = header.find(b"\x00")
+        if nul != -1:
+            fmt, size = header[:nul].split(b" ")
+            return fmt, int(size), header[nul + 1:]
+        if len(header) > 64:
+            break
+    raise Exception("Malformed object header")
+
+
+def object_header(repo, sha):
+    """Return (fmt, size) of an object, inflating only its header"""
+    path = repo.repo_path("objects", sha[0:2], sha[2:])
+    if not os.path.exists(path):
+        result = pack_header(repo, sha)
+        if result is None:
+            raise Exception(f"Object {sha} not found")
+        return result
+
+    with open(path, "rb") as f:
+        pieces = iter(lambda: f.read(1024), b"")
+        fmt, size, _ = _loose_header(inflate_chunks(pieces, 64, limit=64))
+    return fmt, size
+
+
+def object_stream(repo, sha, chunk_size=STREAM_CHUNK_SIZE):
+    """Read an object incrementally
+
+    Yields (fmt, size) first and then the content in chunks of at most
+    chunk_size bytes, so a large blob can be copied to a file or pipe
+    without ever being held in memory.
+    """
+    path = repo.repo_path("objects", sha[0:2], sha[2:])
+    if not os.path.exists(path):
+        stream = pack_stream(repo, sha, chunk_size)
+        if stream is None:
+            raise Exception(f"Object {sha} not found")
+        yield from stream
+        return
+
+    with open(path, "rb") as f:
+        chunks = inflate_chunks(iter(lambda: f.read(STREAM_CHUNK_SIZE), b""), chunk_size)
+        fmt, size, first = _loose_header(chunks)
+        yield fmt, size
+
+        total = len(first)
+        if first:
+            yield first
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+
+    if total != size:
+        raise Exception("Malformed object")
+
+
+def object_read(repo, sha):
+    """Read and parse an object, going through the repository object cache"""
+    obj = repo.object_cache.get(sha)
+    if obj is not None:
+        return obj
+
+    fmt, content = object_read_raw(repo, sha)
+
     if fmt == b"blob":
         obj = GitBlob(repo, content)
-        return obj
     elif fmt == b"tree":
         obj = GitTree(repo, content)
-        return obj
     elif fmt == b"commit":
         obj = GitCommit(repo, content)
-        return obj
+    else:
+        raise Exception(f"Unknown type {fmt}")
+
+    repo.object_cache.put(sha, obj, len(content))
+    return obj
+
+
+def object_exists(repo, sha):
+    """True if sha is stored loose or in a pack"""
+    return os.path.exists(repo.repo_path("objects", sha[0:2], sha[2:])) or pack_has(repo, sha)
+
 
-    raise Exception(f"Unknown type {fmt}")
+@contextlib.contextmanager
+def object_write_batch(repo):
+    """Defer the directory fsyncs of loose object writes to the end of a block
+
+    Each object file is still synced before it is renamed into place, but
+    each objects/xx directory is synced once for the whole batch rather
+    than once per object.
+    """
+    if repo.object_sync_dirs is not None:
+        # Already inside a batch; the outermost one syncs
+        yield
+        return
+    repo.object_sync_dirs = set()
+    try:
+        yield
+    finally:
+        dirs, repo.object_sync_dirs = repo.object_sync_dirs, None
+        for dir_path in sorted(dirs):
+            fsync_dir(dir_path)
+
+
+def _loose_write(repo, sha, chunks):
+    """Store compressed chunks as the loose object sha
+
+    The data goes to a temporary file next to its final name, is synced,
+    and is then renamed into place, so a crash never leaves a truncated
+    object behind. The directory entry is synced afterwards, or at the end
+    of the current object_write_batch.
+    """
+    dir_path = repo.repo_path("objects", sha[0:2])
+    dirs = [dir_path]
+    if not os.path.isdir(dir_path):
+        # Concurrent writers may race to create the same directory
+        os.makedirs(dir_path, exist_ok=True)
+        dirs.append(os.path.dirname(dir_path))
+
+    fd, tmp_path = tempfile.mkstemp(prefix="tmp_obj_", dir=dir_path)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        # Objects are immutable; mkstemp creates files readable by the owner only
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, os.path.join(dir_path, sha[2:]))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    if repo.object_sync_dirs is not None:
+        repo.object_sync_dirs.update(dirs)
+    else:
+        for path in dirs:
+            fsync_dir(path)
 
 
 def object_write(obj, actually_write=True):
+    """Hash an object and store it unless it is already in the repository"""
     data = obj.serialize()
     result = obj.fmt + b" " + str(len(data)).encode() + b"\x00" + data
     sha = hashlib.sha1(result).hexdigest()
 
-    if actually_write:
-        path = obj.repo.repo_file("objects", sha[0:2], sha[2:], mkdir=True)
-        with open(path, "wb") as f:
-            f.write(zlib.compress(result))
-    return sha 
\ No newline at end of file
+    if actually_write and not object_exists(obj.repo, sha):
+        level = obj.repo.loose_compression
+        if obj.fmt == b"blob":
+            level = blob_compression_level(level, data[:STREAM_CHUNK_SIZE], len(data))
+        _loose_write(obj.repo, sha, [zlib.compress(result, level)])
+    return sha
+
+
+def object_write_path(repo, path, st, actually_write=True):
+    """Hash a worktree file as a blob; a symlink's blob is its target path
+
+    st is the file's lstat result.
+    """
+    if stat.S_ISLNK(st.st_mode):
+        blob = GitBlob(repo)
+        blob.blobdata = os.fsencode(os.readlink(path))
+        return object_write(blob, actually_write=actually_write)
+    return object_write_file(repo, path, actually_write=actually_write)
+
+
+def _file_chunks(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def object_write_file(repo, path, fmt=b"blob", actually_write=True):
+    """Store a file as an object without holding it in memory
+
+    The file is hashed a chunk at a time first, so a file whose object
+    already exists is never compressed. Otherwise it is read a second time
+    through zlib into the object store, and hashed again to make sure it
+    did not change in between. Memory use is flat in the file size.
+
+    Blobs are compressed at core.looseCompression, or stored at level 0
+    when their first chunk shows the content is already compressed.
+    """
+    size = os.stat(path).st_size
+    header = fmt + b" " + str(size).encode() + b"\x00"
+    sha = hashlib.sha1(header)
+    read = 0
+    sample = b""
+    for chunk in _file_chunks(path):
+        if not read:
+            sample = chunk
+        read += len(chunk)
+        sha.update(chunk)
+    if read != size:
+        raise Exception(f"{path} changed size while it was being hashed")
+    sha = sha.hexdigest()
+
+    if not actually_write or object_exists(repo, sha):
+        return sha
+
+    level = repo.loose_compression
+    if fmt == b"blob":
+        level = blob_compression_level(level, sample, size)
+
+    def compressed():
+        compressor = zlib.compressobj(level)
+        check = hashlib.sha1(header)
+        yield compressor.compress(header)
+        for chunk in _file_chunks(path):
+            check.update(chunk)
+            yield compressor.compress(chunk)
+        if check.hexdigest() != sha:
+            raise Exception(f"{path} changed while it was being hashed")
+        yield compressor.flush()
+
+    _loose_write(repo, sha, compressed())
+    return sha
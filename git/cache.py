@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+
+# Default bound on the decompressed bytes kept by an ObjectCache
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class ObjectCache:
+    """An LRU cache of parsed objects keyed by SHA
+
+    The cache is bounded by the total decompressed size of the objects it
+    holds; the least recently used objects are evicted first. Cached objects
+    are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, limit=DEFAULT_CACHE_SIZE):
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def get(self, sha):
+        entry = self.entries.get(sha)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(sha)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, sha, obj, size):
+        if size > self.limit:
+            return
+        if sha in self.entries:
+            self.size -= self.entries.pop(sha)[1]
+        self.entries[sha] = (obj, size)
+        self.size += size
+        while self.size > self.limit:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __contains__(self, sha):
+        return sha in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,2 +1,2 @@
 # For the package initialization
-from . import init, cat_file, hash_object, log, commit, ls_tree, write_tree, commit_tree, branch, checkout 
\ No newline at end of file
+from . import init, cat_file, hash_object, log, commit, ls_tree, write_tree, commit_tree, branch, checkout, gc, add, commit_graph, diff_tree, status, pack_refs, reflog 
\ No newline at end of file
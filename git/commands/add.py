@@ -0,0 +1,65 @@
+import os
+import sys
+import repo
+from base import object_write_batch, object_write_path
+from index import index_read, index_write
+from worktree import file_mode
+
+
+def setup_parser(subparsers):
+    parser = subparsers.add_parser(
+        "add", help="Add file contents to the index"
+    )
+    parser.add_argument("paths", nargs="+", help="Files or directories to add")
+    parser.set_defaults(func=cmd_add)
+
+
+def add_file(repo_obj, index, full_path):
+    """Record one file or symlink in the index, hashing it only if its stat data changed"""
+    rel_path = os.path.relpath(full_path, repo_obj.worktree).replace(os.sep, "/")
+    st = os.lstat(full_path)
+    mode = file_mode(repo_obj, st, index.entries.get(rel_path))
+    sha = index.lookup_clean(rel_path, st)
+    if sha is None:
+        sha = object_write_path(repo_obj, full_path, st)
+    elif index.entries[rel_path].mode == mode:
+        return
+
+    index.update(rel_path, sha, st, mode=mode)
+
+
+def add_paths(repo_obj, index, paths):
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirs, files in os.walk(path):
+                if ".git" in dirs:
+                    dirs.remove(".git")
+                # Symlinks to directories are listed with the directories
+                # but are stored as links, like files
+                links = [name for name in dirs if os.path.islink(os.path.join(root, name))]
+                dirs[:] = [name for name in dirs if name not in links]
+                for name in files + links:
+                    add_file(repo_obj, index, os.path.join(root, name))
+        elif os.path.lexists(path):
+            add_file(repo_obj, index, path)
+        else:
+            # A path that no longer exists is removed from the index
+            rel_path = os.path.relpath(path, repo_obj.worktree).replace(os.sep, "/")
+            if rel_path not in index.entries:
+                raise Exception(f"pathspec '{path}' did not match any files")
+            index.remove(rel_path)
+
+
+def cmd_add(args):
+    r = repo.GitRepository(".", force=True)
+    index = index_read(r)
+
+    try:
+        with object_write_batch(r):
+            add_paths(r, index, args.paths)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
+
+    if index.dirty:
+        index_write(r, index)
@@ -38,12 +38,11 @@ def cmd_branch(args):
         # Get the current branch
         current = get_current_branch(r)
         
-        # Get all branches
-        refs = r.ref_list()
-        branches = [ref[11:] for ref in refs if ref.startswith("refs/heads/")]
+        # Get all branches; ref_list returns them sorted
+        branches = [ref[11:] for ref in r.ref_list("refs/heads")]
         
         # Print the branches
-        for branch in sorted(branches):
+        for branch in branches:
             prefix = "* " if branch == current else "  "
             print(f"{prefix}{branch}")
         return
@@ -54,13 +53,18 @@ def cmd_branch(args):
             print("Error: Missing branch name to delete", file=sys.stderr)
             return
             
-        path = r.repo_file("refs", "heads", args.name)
-        if not path or not os.path.exists(path):
+        ref = f"refs/heads/{args.name}"
+        value = r.ref_read(ref)
+        if value is None:
             print(f"Error: Branch '{args.name}' does not exist", file=sys.stderr)
             return
             
-        # Delete the branch file
-        os.unlink(path)
+        # Delete the branch, whether loose or packed
+        try:
+            r.ref_delete(ref, value)
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return
         print(f"Deleted branch {args.name}")
         return
         
@@ -80,6 +84,13 @@ def cmd_branch(args):
             return
             
         # Create the branch reference
-        r.ref_create(f"refs/heads/{args.name}", start_point_sha)
+        try:
+            r.ref_create(
+                f"refs/heads/{args.name}", start_point_sha,
+                f"branch: Created from {args.start_point}",
+            )
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return
         print(f"Created branch {args.name} at {start_point_sha[:7]}")
         return 
\ No newline at end of file
@@ -1,17 +1,105 @@
+import os
+import re
 import sys
 import repo
-from base import object_read
+from base import object_header, object_stream
+
+
+# Full hex SHAs need no reference lookup
+SHA_RE = re.compile(r"[0-9a-f]{40}")
 
 
 def setup_parser(subparsers):
     parser = subparsers.add_parser(
         "cat-file", help="Provide content of repository objects"
     )
-    parser.add_argument("object", help="The SHA1 of the object to display")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-t", dest="show_type", action="store_true",
+                      help="Show the object type instead of its content")
+    mode.add_argument("-s", dest="show_size", action="store_true",
+                      help="Show the object size instead of its content")
+    mode.add_argument("--batch", action="store_true",
+                      help="Print header and content for each object named on stdin")
+    mode.add_argument("--batch-check", action="store_true",
+                      help="Print the header for each object named on stdin")
+    parser.add_argument("--buffer", action="store_true",
+                        help="In batch mode, don't flush output after each object")
+    parser.add_argument("object", nargs="?", help="The SHA1 of the object to display")
     parser.set_defaults(func=cmd_cat_file)
 
 
+def object_name_resolve(r, name):
+    """The SHA a name stands for: a full SHA as is, anything else as a ref"""
+    return name if SHA_RE.fullmatch(name) else r.ref_resolve(name)
+
+
+def cat_file_batch(r, lines, out, contents=True, flush=True):
+    """Answer one object request per input line, like git cat-file --batch
+
+    Each object gets a "<sha> <type> <size>" line, followed by its content
+    and a newline when contents is set; unknown names get "<name> missing".
+    All requests share one repository handle, so packs are mapped once.
+    """
+    for line in lines:
+        name = line.strip()
+        sha = object_name_resolve(r, name)
+
+        try:
+            if contents:
+                stream = object_stream(r, sha)
+                fmt, size = next(stream)
+            else:
+                fmt, size = object_header(r, sha)
+        except Exception:
+            out.write(f"{name} missing\n".encode())
+        else:
+            out.write(f"{sha} {fmt.decode('ascii')} {size}\n".encode())
+            if contents:
+                for chunk in stream:
+                    out.write(chunk)
+                out.write(b"\n")
+
+        # Interactive callers wait for each answer before asking again
+        if flush:
+            out.flush()
+
+
 def cmd_cat_file(args):
     r = repo.GitRepository(".", force=True)
-    obj = object_read(r, args.object)
-    sys.stdout.buffer.write(obj.serialize())
+
+    if args.batch or args.batch_check:
+        lines = (line.decode("utf8") for line in sys.stdin.buffer)
+        try:
+            cat_file_batch(r, lines, sys.stdout.buffer,
+                           contents=args.batch, flush=not args.buffer)
+        except BrokenPipeError:
+            # The reader (e.g. head) went away; stop quietly
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+
+    if not args.object:
+        print("Error: an object is required unless --batch or --batch-check is given",
+              file=sys.stderr)
+        return
+
+    sha = object_name_resolve(r, args.object)
+    try:
+        # Type and size only need the object header
+        if args.show_type or args.show_size:
+            fmt, size = object_header(r, sha)
+            print(fmt.decode("ascii") if args.show_type else size)
+            return
+        stream = object_stream(r, sha)
+        next(stream)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
+
+    # Copy the content to stdout a chunk at a time
+    out = sys.stdout.buffer
+    try:
+        for chunk in stream:
+            out.write(chunk)
+        out.flush()
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
@@ -1,7 +1,9 @@
-import os
 import sys
 import repo
 from base import object_read
+from index import index_lock, index_read, index_unlock, index_write
+from refs import RefTransaction
+from worktree import checkout_tree
 
 
 def setup_parser(subparsers):
@@ -12,8 +14,19 @@ def setup_parser(subparsers):
     parser.set_defaults(func=cmd_checkout)
 
 
+def head_tree(r):
+    """Tree of the commit HEAD points at, or None on an unborn branch"""
+    try:
+        commit = object_read(r, r.ref_resolve("HEAD"))
+    except Exception:
+        return None
+    return commit.header("tree") if commit.fmt == b"commit" else None
+
+
 def cmd_checkout(args):
     r = repo.GitRepository(".", force=True)
+    # HEAD must still hold this when it is rewritten below
+    old_head = r.ref_read("HEAD")
     
     # Resolve the reference to a commit SHA
     commit_sha = r.ref_resolve(args.branch)
@@ -27,23 +40,47 @@ def cmd_checkout(args):
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         return
+
+    # Bring the working tree and index over to the target tree, touching
+    # only the files that differ from the current commit. The index is
+    # locked first, so no file changes unless the index can follow.
+    try:
+        lock = index_lock(r)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
+    try:
+        index = index_read(r)
+        checkout_tree(r, index, head_tree(r), commit.header("tree"))
+    except Exception as e:
+        index_unlock(r, lock)
+        print(f"Error: {e}", file=sys.stderr)
+        return
+    if index.dirty:
+        index_write(r, index, lock)
+    else:
+        index_unlock(r, lock)
     
-    # Update HEAD
-    head_path = r.repo_file("HEAD")
-    
-    # If the branch is in refs/heads, make HEAD a symbolic ref
-    branch_path = r.repo_file("refs", "heads", args.branch)
-    if branch_path and os.path.exists(branch_path):
-        # It's a branch, update HEAD to point to it
-        with open(head_path, "w") as f:
-            f.write(f"ref: refs/heads/{args.branch}\n")
+    # Update HEAD: a symbolic ref if the target is a branch, otherwise the
+    # commit itself (detached HEAD state)
+    if r.ref_read(f"refs/heads/{args.branch}") is not None:
+        head = f"ref: refs/heads/{args.branch}"
+    else:
+        head = commit_sha
+    transaction = RefTransaction(r)
+    if old_head and old_head.startswith("ref: refs/heads/"):
+        moving_from = old_head[16:]
+    else:
+        moving_from = old_head
+    transaction.update("HEAD", head, old_head, f"checkout: moving from {moving_from} to {args.branch}")
+    try:
+        transaction.commit()
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
+
+    if head != commit_sha:
         print(f"Switched to branch '{args.branch}'")
     else:
-        # It's a commit, set HEAD to the commit (detached HEAD state)
-        with open(head_path, "w") as f:
-            f.write(f"{commit_sha}\n")
         print(f"Note: checking out '{commit_sha[:7]}'")
         print("You are in 'detached HEAD' state.")
-        
-    # TODO: In a full implementation, we would update the working directory
-    # to match the tree from the commit. For now, we'll just update HEAD. 
\ No newline at end of file
@@ -5,6 +5,7 @@ import repo
 from commands.write_tree import write_tree
 from base import object_write
 from object import GitCommit
+from refs import NULL_SHA, RefTransaction
 
 
 def setup_parser(subparsers):
@@ -26,42 +27,34 @@ def get_parent_commit(repo_obj):
     with open(head_path, "r") as f:
         head_content = f.read().strip()
     
-    # If it's a ref, resolve it
+    # If it's a ref, resolve it; the branch may be loose or packed, and
+    # is missing until its first commit
     if head_content.startswith("ref: "):
-        ref = head_content[5:]
-        ref_path = repo_obj.repo_file(ref)
-        
-        if ref_path and os.path.exists(ref_path):
-            with open(ref_path, "r") as f:
-                return f.read().strip()
+        return repo_obj.ref_read(head_content[5:])
     else:
         # HEAD might be a detached head (direct SHA)
         return head_content
-            
-    return None
 
 
-def update_ref(repo_obj, ref, commit_sha):
-    """Update a reference to point to a new commit"""
-    head_path = repo_obj.repo_file("HEAD")
-    if not head_path or not os.path.exists(head_path):
-        raise Exception("HEAD reference not found")
-        
-    # Read HEAD
-    with open(head_path, "r") as f:
-        head_content = f.read().strip()
-    
-    # If it's a ref, update the ref
-    if head_content.startswith("ref: "):
-        ref = head_content[5:]
-        ref_path = repo_obj.repo_file(ref, mkdir=True)
-        
-        with open(ref_path, "w") as f:
-            f.write(commit_sha + "\n")
-    else:
-        # Update HEAD directly (detached head state)
-        with open(head_path, "w") as f:
-            f.write(commit_sha + "\n")
+def update_ref(repo_obj, ref, commit_sha, old_sha=None, message=""):
+    """Update a reference to point to a new commit
+
+    A symbolic ref such as HEAD updates the branch it points at. With
+    old_sha the update only happens if the ref still holds it (NULL_SHA for
+    an unborn branch), so a concurrent commit is never lost. message goes
+    into the reflog.
+    """
+    content = repo_obj.ref_read(ref)
+    if content is None:
+        raise Exception(f"{ref} reference not found")
+
+    # If it's a ref, update the ref; otherwise HEAD is detached
+    if content.startswith("ref: "):
+        ref = content[5:]
+
+    transaction = RefTransaction(repo_obj)
+    transaction.update(ref, commit_sha, old_sha, message)
+    transaction.commit()
 
 
 def cmd_commit(args):
@@ -107,8 +100,15 @@ def cmd_commit(args):
     # Write the commit object
     commit_sha = object_write(commit)
     
-    # Update the current branch to point to this commit
-    update_ref(r, "HEAD", commit_sha)
+    # Update the current branch to point to this commit, unless another
+    # commit moved it since we read the parent
+    try:
+        subject = args.message.split("\n", 1)[0]
+        reason = "commit" if parent else "commit (initial)"
+        update_ref(r, "HEAD", commit_sha, parent or NULL_SHA, f"{reason}: {subject}")
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
     
     print(f"[{get_current_branch(r) or 'detached HEAD'} {commit_sha[:7]}] {args.message}")
 
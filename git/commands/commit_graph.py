@@ -0,0 +1,32 @@
+import sys
+import repo
+from commit_graph import commit_graph_write
+
+
+def setup_parser(subparsers):
+    parser = subparsers.add_parser(
+        "commit-graph", help="Write the commit-graph file used by history walks"
+    )
+    parser.add_argument("action", choices=["write"], help="Action to perform")
+    parser.set_defaults(func=cmd_commit_graph)
+
+
+def graph_tips(repo_obj):
+    """Commit SHAs of HEAD and every reference"""
+    tips = set()
+    for ref in ["HEAD"] + repo_obj.ref_list():
+        sha = repo_obj.ref_resolve(ref)
+        if sha and sha != ref:
+            tips.add(sha)
+    return tips
+
+
+def cmd_commit_graph(args):
+    r = repo.GitRepository(".", force=True)
+
+    try:
+        count = commit_graph_write(r, graph_tips(r))
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
+    print(f"Wrote commit-graph with {count} commit(s)")
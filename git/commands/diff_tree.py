@@ -0,0 +1,60 @@
+import sys
+import repo
+from base import object_read
+from diff import change_status, diff_stat, diff_stat_format, resolve_tree, tree_diff
+
+
+def setup_parser(subparsers):
+    parser = subparsers.add_parser(
+        "diff-tree", help="Compare the content of two trees or a commit and its parent"
+    )
+    parser.add_argument("old", help="Tree or commit; alone, a commit is compared to its first parent")
+    parser.add_argument("new", nargs="?", help="Tree or commit to compare against")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="Descend into subtrees and report files")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--name-only", action="store_true", help="Show only changed paths")
+    group.add_argument("--name-status", action="store_true", help="Show paths with A/D/M status")
+    group.add_argument("--stat", action="store_true", help="Show a diffstat (implies -r)")
+    parser.set_defaults(func=cmd_diff_tree)
+
+
+def format_raw(path, old, new):
+    """One line of git's raw diff format"""
+    old_mode, old_sha = old or ("0", "0" * 40)
+    new_mode, new_sha = new or ("0", "0" * 40)
+    return (f":{int(old_mode, 8):06o} {int(new_mode, 8):06o} {old_sha} {new_sha} "
+            f"{change_status(old, new)}\t{path}")
+
+
+def cmd_diff_tree(args):
+    r = repo.GitRepository(".", force=True)
+
+    try:
+        if args.new:
+            old_tree = resolve_tree(r, args.old)
+            new_tree = resolve_tree(r, args.new)
+        else:
+            # A single commit is shown against its first parent
+            commit_sha = r.ref_resolve(args.old)
+            commit = object_read(r, commit_sha)
+            if commit.fmt != b"commit":
+                raise Exception(f"{args.old} is not a commit")
+            parents = commit.parents
+            old_tree = resolve_tree(r, parents[0]) if parents else None
+            new_tree = commit.header("tree")
+            print(commit_sha)
+
+        changes = list(tree_diff(r, old_tree, new_tree, recursive=args.recursive or args.stat))
+        if args.stat:
+            print(diff_stat_format(diff_stat(r, changes)), end="")
+            return
+        for path, old, new in changes:
+            if args.name_only:
+                print(path)
+            elif args.name_status:
+                print(f"{change_status(old, new)}\t{path}")
+            else:
+                print(format_raw(path, old, new))
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
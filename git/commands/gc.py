@@ -0,0 +1,85 @@
+import os
+import repo
+from base import object_read_raw
+from object import GitTree
+from pack import pack_write
+
+
+def setup_parser(subparsers):
+    parser = subparsers.add_parser(
+        "gc", help="Pack loose objects and remove the packed loose files"
+    )
+    parser.add_argument("--window", type=int, default=10,
+                        help="Number of objects to try as delta bases (default: 10)")
+    parser.add_argument("--depth", type=int, default=50,
+                        help="Maximum delta chain length (default: 50)")
+    parser.set_defaults(func=cmd_gc)
+
+
+def loose_objects(repo_obj):
+    """List the SHAs of all loose objects"""
+    objects_dir = repo_obj.repo_path("objects")
+    shas = []
+    if not os.path.isdir(objects_dir):
+        return shas
+
+    for prefix in sorted(os.listdir(objects_dir)):
+        if len(prefix) != 2 or not os.path.isdir(os.path.join(objects_dir, prefix)):
+            continue
+        for rest in sorted(os.listdir(os.path.join(objects_dir, prefix))):
+            if len(rest) == 38:
+                shas.append(prefix + rest)
+    return shas
+
+
+def repack(repo_obj, window=10, depth=50):
+    """Write all loose objects into one pack, returning (pack name, SHAs)"""
+    shas = loose_objects(repo_obj)
+    if not shas:
+        return None, []
+
+    objects = {sha: object_read_raw(repo_obj, sha) for sha in shas}
+
+    # Tree entries name the blobs they contain, which lets the delta search
+    # group successive versions of the same file together
+    names = {}
+    for sha, (fmt, data) in objects.items():
+        if fmt == b"tree":
+            for mode, path, entry_sha in GitTree(repo_obj, data):
+                names.setdefault(entry_sha, path)
+
+    pack_dir = repo_obj.repo_path("objects", "pack")
+    pack_name = pack_write(
+        pack_dir,
+        [(fmt, data, names.get(sha, "")) for sha, (fmt, data) in objects.items()],
+        window=window,
+        depth=depth,
+        compression=repo_obj.pack_compression,
+    )
+
+    # Make the new pack visible before the loose copies disappear
+    repo_obj.packs = None
+    return pack_name, shas
+
+
+def prune_packed(repo_obj, shas):
+    """Delete loose objects that are now stored in a pack"""
+    for sha in shas:
+        os.unlink(repo_obj.repo_path("objects", sha[0:2], sha[2:]))
+
+    for prefix in {sha[0:2] for sha in shas}:
+        path = repo_obj.repo_path("objects", prefix)
+        if not os.listdir(path):
+            os.rmdir(path)
+
+
+def cmd_gc(args):
+    r = repo.GitRepository(".", force=True)
+
+    pack_name, shas = repack(r, window=args.window, depth=args.depth)
+    if not pack_name:
+        print("Nothing to pack")
+        return
+
+    prune_packed(r, shas)
+    print(f"Packed {len(shas)} objects into pack-{pack_name}.pack")
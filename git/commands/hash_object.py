@@ -1,6 +1,5 @@
 import sys
-from object import GitBlob
-from base import object_write
+from base import object_write_file
 import repo
 
 
@@ -14,9 +13,5 @@ def setup_parser(subparsers):
 
 
 def cmd_hash_object(args):
-    with open(args.path, "rb") as f:
-        data = f.read()
-
     r = repo.GitRepository(".", force=True)
-    obj = GitBlob(r, data)
-    print(object_write(obj, actually_write=True))
+    print(object_write_file(r, args.path, actually_write=True))
@@ -1,44 +1,109 @@
 import sys
 import repo
 from base import object_read
+from commit_graph import commit_info
+from revwalk import parse_date, rev_walk
+from log_format import LogFormatter
+from diff import diff_stat, diff_stat_format, tree_diff
 import os
+import subprocess
 import traceback
 
 
+# Commits rendered per write to the output stream
+LOG_BATCH = 256
+
+
 def setup_parser(subparsers):
     parser = subparsers.add_parser("log", help="Show commit logs")
-    parser.add_argument("commit", default="HEAD", nargs="?",
-                        help="Commit to start at (default: HEAD)")
+    parser.add_argument("commit", nargs="*",
+                        help="Revisions to show, as refs, ^ref exclusions or A..B ranges (default: HEAD)")
+    parser.add_argument("-n", "--max-count", type=int, default=None,
+                        help="Show at most this many commits")
+    parser.add_argument("--since", "--after", dest="since", default=None,
+                        help="Show commits newer than a date")
+    parser.add_argument("--until", "--before", dest="until", default=None,
+                        help="Show commits older than a date")
+    parser.add_argument("--first-parent", action="store_true",
+                        help="Follow only the first parent of merge commits")
+    parser.add_argument("--format", "--pretty", dest="pretty", default="medium",
+                        help="Output format: medium, short, oneline, or a template with "
+                             "placeholders like %%H, %%h, %%an, %%ad, %%s")
+    parser.add_argument("--oneline", dest="pretty", action="store_const", const="oneline",
+                        help="Shorthand for --format=oneline")
+    parser.add_argument("--stat", action="store_true",
+                        help="Show files changed by each commit, with line counts")
+    parser.add_argument("--no-pager", action="store_true",
+                        help="Do not pipe output into $PAGER")
     parser.add_argument("-v", "--verbose", action="store_true", 
                         help="Show verbose debug information")
     parser.set_defaults(func=cmd_log)
 
 
-def get_commit_from_ref(r, ref, verbose=False):
-    """Get the commit SHA from a reference (branch or HEAD)"""
-    if verbose:
-        print(f"Resolving reference: {ref}")
-        
+def open_pager():
+    """Start $GIT_PAGER or $PAGER when stdout is a terminal
+
+    Returns the pager process, or None to write to stdout directly.
+    """
+    if not sys.stdout.isatty():
+        return None
+    pager = os.environ.get("GIT_PAGER") or os.environ.get("PAGER") or "less"
+    if pager == "cat":
+        return None
+
+    env = dict(os.environ)
+    env.setdefault("LESS", "FRX")
     try:
-        # Use the repository's ref_resolve method to handle all reference types
-        sha = r.ref_resolve(ref)
-        
-        if verbose:
-            print(f"Reference '{ref}' resolved to: {sha}")
-            
-        return sha
-    except Exception as e:
-        if verbose:
-            print(f"Error resolving reference '{ref}': {e}")
-            print(traceback.format_exc())
-        raise
+        return subprocess.Popen(pager, shell=True, stdin=subprocess.PIPE, env=env,
+                                encoding="utf8", errors="replace")
+    except OSError:
+        return None
+
+
+def close_pager(pager):
+    try:
+        pager.stdin.close()
+    except BrokenPipeError:
+        pass
+    pager.wait()
+
+
+def commit_stat(r, commit, parents):
+    """Diffstat of a commit against its first parent"""
+    old_tree = object_read(r, parents[0]).header("tree") if parents else None
+    changes = tree_diff(r, old_tree, commit.header("tree"))
+    return diff_stat_format(diff_stat(r, changes))
+
+
+def write_log(r, walk, formatter, out, stat=False):
+    """Render the commits of walk to out, LOG_BATCH commits per write
+
+    Returns the number of commits written. Commit objects are only read
+    when the format needs more than hashes and parents. With stat, each
+    non-merge commit is followed by its diffstat.
+    """
+    batch = []
+    count = 0
+    for sha in walk:
+        parents = commit_info(r, sha)[0]
+        commit = object_read(r, sha) if formatter.needs_commit or stat else None
+        batch.append(formatter.render(sha, parents, commit))
+        if stat and len(parents) <= 1:
+            batch.append(commit_stat(r, commit, parents) + "\n")
+        count += 1
+        if len(batch) == LOG_BATCH:
+            out.write("".join(batch))
+            batch.clear()
+    out.write("".join(batch))
+    out.flush()
+    return count
 
 
 def cmd_log(args):
     verbose = args.verbose
     
     if verbose:
-        print(f"Starting log command with commit: {args.commit}")
+        print(f"Starting log command with revisions: {args.commit or ['HEAD']}")
         print(f"Current working directory: {os.getcwd()}")
     
     try:
@@ -56,62 +121,44 @@ def cmd_log(args):
         if verbose:
             print("Repository initialized successfully.")
         
-        # Get the commit SHA from the reference
         try:
-            commit_sha = get_commit_from_ref(r, args.commit, verbose)
-            
-            if not commit_sha:
-                print(f"Error: Reference '{args.commit}' could not be resolved to a commit.", file=sys.stderr)
-                return
+            walk = rev_walk(
+                r, args.commit, max_count=args.max_count,
+                first_parent=args.first_parent,
+                since=parse_date(args.since) if args.since else None,
+                until=parse_date(args.until) if args.until else None,
+            )
         except Exception as e:
             print(f"Error: {e}", file=sys.stderr)
             if verbose:
                 print(traceback.format_exc())
             return
-        
-        # Start traversing commits
+
+        formatter = LogFormatter(args.pretty)
+        # Verbose output goes to stdout as well, so it is never paged
+        pager = None if verbose or args.no_pager else open_pager()
+        out = pager.stdin if pager else sys.stdout
+
         commit_count = 0
-        while commit_sha:
-            try:
-                # Read the commit object
-                commit = object_read(r, commit_sha)
-                commit_count += 1
-                
-                # Print commit info
-                print(f"commit {commit_sha}")
-                print(f"Author: {commit.kvlm.get('author', 'Unknown')}")
-                
-                # Format the date in a more readable way
-                committer_info = commit.kvlm.get('committer', 'Unknown')
-                if '>' in committer_info:
-                    date_part = committer_info.split('>')[1].strip()
-                    print(f"Date:   {date_part}")
-                else:
-                    print(f"Date:   {committer_info}")
-                    
-                print()
-                print(f"    {commit.kvlm.get('_message', '').strip()}")
-                print()
-                
-                # Move to parent commit
-                parent = commit.kvlm.get("parent")
-                if parent:
-                    if verbose:
-                        print(f"Following parent: {parent}")
-                    commit_sha = parent
-                else:
-                    if verbose:
-                        print("Reached root commit (no parent)")
-                    break
-                    
-            except Exception as e:
-                print(f"Error processing commit {commit_sha}: {e}", file=sys.stderr)
-                if verbose:
-                    print(traceback.format_exc())
-                break
-        
+        try:
+            commit_count = write_log(r, walk, formatter, out, stat=args.stat)
+        except BrokenPipeError:
+            # The pager or downstream reader quit; stop walking history
+            if not pager:
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            if verbose:
+                print(traceback.format_exc())
+        finally:
+            if pager:
+                close_pager(pager)
+
         if verbose:
             print(f"Displayed {commit_count} commit(s)")
+            cache = r.object_cache
+            print(f"Object cache: {cache.hits} hit(s), {cache.misses} miss(es), "
+                  f"{len(cache)} object(s), {cache.size} byte(s)")
     
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
@@ -19,5 +19,5 @@ def cmd_ls_tree(args):
         print(f"Object {args.object} is not a tree.", file=sys.stderr)
         return
     
-    for mode, path, sha in obj.items:
+    for mode, path, sha in obj:
         print(f"{mode} {sha} {path}") 
\ No newline at end of file
@@ -0,0 +1,25 @@
+import sys
+import repo
+from refs import pack_refs
+
+
+def setup_parser(subparsers):
+    parser = subparsers.add_parser(
+        "pack-refs", help="Pack references into the packed-refs file"
+    )
+    parser.add_argument("--all", action="store_true",
+                        help="Pack branches as well as tags")
+    parser.add_argument("--no-prune", dest="prune", action="store_false",
+                        help="Keep the loose ref files after packing")
+    parser.set_defaults(func=cmd_pack_refs)
+
+
+def cmd_pack_refs(args):
+    r = repo.GitRepository(".", force=True)
+
+    try:
+        count = pack_refs(r, all_refs=args.all, prune=args.prune)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
+    print(f"Packed {count} ref(s)")
@@ -0,0 +1,75 @@
+import itertools
+import os
+import sys
+import time
+import repo
+from reflog import reflog_entries, reflog_expire, reflog_list, reflog_path
+from revwalk import parse_date
+
+
+# Entries older than this are dropped by "reflog expire", as in git
+DEFAULT_EXPIRE = "90.days.ago"
+
+
+def setup_parser(subparsers):
+    parser = subparsers.add_parser(
+        "reflog", help="Show or expire the history of ref updates"
+    )
+    parser.add_argument("args", nargs="*", metavar="[show|expire] <ref>",
+                        help="Subcommand (default show) and refs (default HEAD)")
+    parser.add_argument("-n", "--max-count", type=int,
+                        help="Show at most this many entries")
+    parser.add_argument("--expire", default=DEFAULT_EXPIRE,
+                        help="Expire entries older than this date (default: 90.days.ago)")
+    parser.add_argument("--all", action="store_true",
+                        help="Expire the reflogs of all refs")
+    parser.set_defaults(func=cmd_reflog)
+
+
+def reflog_name(r, ref):
+    """The ref whose reflog a name like "master" or "HEAD" refers to"""
+    for name in [ref, "refs/" + ref, "refs/heads/" + ref, "refs/tags/" + ref]:
+        if os.path.isfile(reflog_path(r, name)):
+            return name
+    return None
+
+
+def expire_cutoff(text):
+    if text == "never":
+        return 0
+    if text in ("now", "all"):
+        return int(time.time())
+    return parse_date(text)
+
+
+def cmd_reflog(args):
+    r = repo.GitRepository(".", force=True)
+    action = "show"
+    refs = args.args
+    if refs and refs[0] in ("show", "expire"):
+        action, refs = refs[0], refs[1:]
+
+    if action == "expire":
+        try:
+            cutoff = expire_cutoff(args.expire)
+            names = reflog_list(r) if args.all else [reflog_name(r, ref) or ref for ref in refs]
+            for name in names:
+                reflog_expire(r, name, cutoff)
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+        return
+
+    ref = refs[0] if refs else "HEAD"
+    name = reflog_name(r, ref)
+    if name is None:
+        print(f"Error: no reflog for '{ref}'", file=sys.stderr)
+        return
+
+    # Entries come newest first, so -n only reads the end of the log
+    entries = itertools.islice(reflog_entries(r, name), args.max_count)
+    try:
+        for i, (_, new_sha, _, _, _, message) in enumerate(entries):
+            print(f"{new_sha[:7]} {ref}@{{{i}}}: {message}")
+    except BrokenPipeError:
+        # Stop quietly when the reader (e.g. head) goes away
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
@@ -0,0 +1,73 @@
+import sys
+import repo
+from commands.branch import get_current_branch
+from commands.checkout import head_tree
+from index import index_read, index_write
+from status import worktree_status
+
+
+STATUS_NAMES = {"A": "new file", "M": "modified", "D": "deleted"}
+
+
+def setup_parser(subparsers):
+    parser = subparsers.add_parser(
+        "status", help="Show staged, unstaged and untracked changes"
+    )
+    parser.add_argument("-s", "--short", action="store_true",
+                        help="Give the output in the short format")
+    parser.set_defaults(func=cmd_status)
+
+
+def format_short(staged, unstaged, untracked):
+    """Two status columns per path, as in git status --short"""
+    codes = {}
+    for code, path in staged:
+        codes[path] = [code, " "]
+    for code, path in unstaged:
+        codes.setdefault(path, [" ", " "])[1] = code
+    lines = [f"{x}{y} {path}" for path, (x, y) in sorted(codes.items())]
+    lines += [f"?? {path}" for path in untracked]
+    return "".join(line + "\n" for line in lines)
+
+
+def format_long(branch, staged, unstaged, untracked):
+    lines = [f"On branch {branch}" if branch else "HEAD detached"]
+    if staged:
+        lines += ["Changes to be committed:"]
+        lines += [f"\t{STATUS_NAMES[code] + ':':<12}{path}" for code, path in staged]
+        lines += [""]
+    if unstaged:
+        lines += ["Changes not staged for commit:"]
+        lines += [f"\t{STATUS_NAMES[code] + ':':<12}{path}" for code, path in unstaged]
+        lines += [""]
+    if untracked:
+        lines += ["Untracked files:"]
+        lines += [f"\t{path}" for path in untracked]
+        lines += [""]
+    if not (staged or unstaged or untracked):
+        lines += ["nothing to commit, working tree clean"]
+    return "".join(line + "\n" for line in lines)
+
+
+def cmd_status(args):
+    r = repo.GitRepository(".", force=True)
+
+    try:
+        index = index_read(r)
+        staged, unstaged, untracked = worktree_status(r, index, head_tree(r))
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return
+
+    if args.short:
+        sys.stdout.write(format_short(staged, unstaged, untracked))
+    else:
+        sys.stdout.write(format_long(get_current_branch(r), staged, unstaged, untracked))
+
+    # Keep the stat data refreshed while checking; a concurrent writer
+    # holding the lock just means the next status does the work again
+    if index.dirty:
+        try:
+            index_write(r, index)
+        except Exception:
+            pass
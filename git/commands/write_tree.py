@@ -1,7 +1,11 @@
 import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
 import repo
-from object import GitTree, GitBlob
-from base import object_write
+from object import GitTree
+from base import object_write, object_write_batch, object_write_path
+from index import index_read, index_write
+from worktree import file_mode
 
 
 def setup_parser(subparsers):
@@ -18,41 +22,150 @@ def cmd_write_tree(args):
 
 
 def write_tree(repo, path):
-    """Create a tree object representing the given directory"""
+    """Create a tree object representing the given directory
+
+    The index doubles as a stat cache: files whose stat data still matches
+    their index entry reuse the recorded SHA instead of being read and
+    hashed again. The index is updated with whatever had to be rehashed.
+
+    Work happens in three passes: the directory is scanned, the files that
+    need hashing are hashed and compressed (on core.writeWorkers threads),
+    and the trees are then assembled bottom-up in a fixed order, so the
+    result does not depend on which worker finished first. Objects that
+    already exist are not written again, and the object directories are
+    synced once at the end rather than after every object.
+    """
+    index = index_read(repo)
+    prefix = os.path.relpath(path, repo.worktree)
+    prefix = "" if prefix == "." else prefix.replace(os.sep, "/") + "/"
+
+    node = index.cache_tree
+    for part in prefix.split("/")[:-1]:
+        node = node.child(part)
+
+    seen = set()
+    pending = []
+    entries = _scan_dir(repo, path, prefix, index, seen, pending)
+
+    with object_write_batch(repo):
+        shas = hash_files(repo, [(full_path, st) for _, full_path, st, _ in pending])
+        hashed = {}
+        for (rel_path, _, st, mode), sha in zip(pending, shas):
+            index.update(rel_path, sha, st, mode=mode)
+            hashed[rel_path] = sha
+
+        tree_sha, _ = _write_tree(repo, entries, hashed, index, node)
+
+    # Files that disappeared from the worktree drop out of the index. The
+    # cache-tree above already accounts for them, so it stays valid.
+    for name in list(index.entries):
+        if name.startswith(prefix) and name not in seen:
+            index.remove(name, invalidate=False)
+
+    if index.dirty:
+        index_write(repo, index)
+    return tree_sha
+
+
+def hash_files(repo, files):
+    """Hash and store several (path, lstat result) files, returning their SHAs in order
+
+    SHA-1, zlib and file I/O all release the GIL, so a thread pool is
+    enough to spread large files over several cores.
+    """
+    if repo.write_workers > 1 and len(files) > 1:
+        with ThreadPoolExecutor(max_workers=repo.write_workers) as pool:
+            return list(pool.map(lambda f: object_write_path(repo, *f), files))
+    return [object_write_path(repo, *f) for f in files]
+
+
+
+def _scan_dir(repo, path, prefix, index, seen, pending):
+    """List a directory recursively, resolving SHAs from the stat cache
+
+    Returns a list of (name, rel_path, sha, mode, children) entries; files
+    and symlinks have children set to None and sha None when they still
+    need hashing, in which case they are also appended to pending.
+    Symlinks are never followed: a link is stored as its target.
+    """
+    entries = []
+    # scandir entries know their type, so only files cost a stat call
+    with os.scandir(path) as it:
+        for entry in it:
+            # Skip .git directory
+            if entry.name == ".git":
+                continue
+
+            rel_path = prefix + entry.name
+
+            if entry.is_dir(follow_symlinks=False):
+                children = _scan_dir(repo, entry.path, rel_path + "/", index, seen, pending)
+                entries.append((entry.name, rel_path, None, 0o40000, children))
+                continue
+
+            st = entry.stat(follow_symlinks=False)
+            if not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                continue
+            seen.add(rel_path)
+            mode = file_mode(repo, st, index.entries.get(rel_path))
+            sha = index.lookup_clean(rel_path, st)
+            if sha is None:
+                pending.append((rel_path, entry.path, st, mode))
+            elif index.entries[rel_path].mode != mode:
+                index.update(rel_path, sha, st, mode=mode)
+            entries.append((entry.name, rel_path, sha, mode, None))
+    return entries
+
+
+def _write_tree(repo, entries, hashed, index, node):
+    """Write the tree for one directory, returning (SHA, number of files)
+
+    node is the directory's cache-tree entry. If it is still valid and the
+    directory holds the same files and subdirectories it did when the SHA
+    was recorded, the tree is neither serialized nor written again.
+    """
     tree = GitTree(repo)
-    tree.items = []
+    entry_count = 0
+    subdirs = set()
     
-    # Gather all files and directories in the current directory
-    entries = []
-    for entry in os.listdir(path):
-        # Skip .git directory
-        if entry == ".git":
-            continue
-            
-        full_path = os.path.join(path, entry)
-        
-        # Add files as blobs
-        if os.path.isfile(full_path):
-            with open(full_path, "rb") as f:
-                data = f.read()
-            
-            # Create blob
-            blob = GitBlob(repo, data)
-            sha = object_write(blob)
+    for name, rel_path, sha, mode, children in entries:
+        # Add files and symlinks as blobs
+        if children is None:
+            if sha is None:
+                sha = hashed[rel_path]
             
-            # Add entry to tree (mode 100644 for regular files)
-            tree.items.append(("100644", entry, sha))
+            tree.add(f"{mode:o}", name, sha)
+            entry_count += 1
         
         # Add directories as subtrees
-        elif os.path.isdir(full_path):
-            # Recursively handle subdirectory
-            subtree_sha = write_tree(repo, full_path)
+        else:
+            # Recursively handle subdirectory; a subtree whose SHA is not the
+            # one recorded before (new, emptied or changed) invalidates this one
+            child = node.child(name)
+            old_sha = child.sha
+            subtree_sha, subtree_count = _write_tree(repo, children, hashed, index, child)
+            if subtree_sha != old_sha:
+                node.sha = None
+            entry_count += subtree_count
+            subdirs.add(name)
             
-            # Add entry to tree (mode 040000 for directories)
-            tree.items.append(("040000", entry, subtree_sha))
+            # Add entry to tree; git writes directory modes unpadded
+            tree.add("40000", name, subtree_sha)
     
-    # Sort entries by name
-    tree.items.sort(key=lambda item: item[1])
+    # Removed files show up as a lower count, removed directories as
+    # stale children
+    for name in list(node.children):
+        if name not in subdirs:
+            del node.children[name]
+            node.sha = None
+    if node.sha is not None and node.entry_count == entry_count:
+        return node.sha, entry_count
+
+    # Sort entries in git order (directories compare as "name/")
+    tree.sort()
     
     # Write the tree object
-    return object_write(tree) 
\ No newline at end of file
+    node.sha = object_write(tree)
+    node.entry_count = entry_count
+    index.dirty = True
+    return node.sha, entry_count
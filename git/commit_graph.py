@@ -0,0 +1,253 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+
+GRAPH_SIGNATURE = b"CGPH"
+
+CHUNK_OID_FANOUT = b"OIDF"
+CHUNK_OID_LOOKUP = b"OIDL"
+CHUNK_COMMIT_DATA = b"CDAT"
+CHUNK_EXTRA_EDGES = b"EDGE"
+
+# Parent slots in CDAT hold a graph position or one of these markers
+PARENT_NONE = 0x70000000
+PARENT_EXTRA = 0x80000000
+
+GENERATION_MAX = 0x3FFFFFFF
+COMMIT_DATA = struct.Struct(">20sIIII")
+
+
+def commit_parse_summary(commit):
+    """Return (parents, committer timestamp) from a parsed commit"""
+    date = 0
+    committer = commit.header("committer", "")
+    if ">" in committer:
+        fields = committer.rsplit(">", 1)[1].split()
+        if fields and fields[0].isdigit():
+            date = int(fields[0])
+    return commit.parents, date
+
+
+class CommitGraph:
+    """Read access to objects/info/commit-graph
+
+    Commits are addressed by their position in the sorted OID table;
+    parents are stored as positions too, so a history walk can go from
+    commit to commit without inflating any commit object.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, hash_version, chunk_count = struct.unpack_from(">4sBBB", self.data, 0)
+        if signature != GRAPH_SIGNATURE:
+            raise Exception(f"Not a commit-graph file: {path}")
+        if version != 1 or hash_version != 1:
+            raise Exception(f"Unsupported commit-graph version {version}")
+
+        self.chunks = {}
+        for i in range(chunk_count):
+            chunk_id, offset = struct.unpack_from(">4sQ", self.data, 8 + 12 * i)
+            self.chunks[chunk_id] = offset
+        for chunk_id in (CHUNK_OID_FANOUT, CHUNK_OID_LOOKUP, CHUNK_COMMIT_DATA):
+            if chunk_id not in self.chunks:
+                raise Exception(f"commit-graph is missing the {chunk_id.decode()} chunk")
+
+        self.fanout = struct.unpack_from(">256I", self.data, self.chunks[CHUNK_OID_FANOUT])
+        self.count = self.fanout[255]
+
+    def close(self):
+        self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def oid(self, pos):
+        start = self.chunks[CHUNK_OID_LOOKUP] + 20 * pos
+        return self.data[start:start + 20].hex()
+
+    def find(self, sha):
+        """Return the graph position of a hex SHA, or None"""
+        try:
+            binsha = bytes.fromhex(sha)
+        except ValueError:
+            return None
+        if len(binsha) != 20:
+            return None
+        lo = self.fanout[binsha[0] - 1] if binsha[0] else 0
+        hi = self.fanout[binsha[0]]
+        base = self.chunks[CHUNK_OID_LOOKUP]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.data[base + 20 * mid:base + 20 * mid + 20]
+            if current < binsha:
+                lo = mid + 1
+            elif current > binsha:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def _commit_data(self, pos):
+        return COMMIT_DATA.unpack_from(self.data, self.chunks[CHUNK_COMMIT_DATA] + COMMIT_DATA.size * pos)
+
+    def tree(self, pos):
+        return self._commit_data(pos)[0].hex()
+
+    def parents(self, pos):
+        """Return the graph positions of a commit's parents"""
+        _, first, second, _, _ = self._commit_data(pos)
+        if first == PARENT_NONE:
+            return []
+        if second == PARENT_NONE:
+            return [first]
+        if not second & PARENT_EXTRA:
+            return [first, second]
+
+        # Octopus merges list their remaining parents in the EDGE chunk
+        parents = [first]
+        edge = self.chunks[CHUNK_EXTRA_EDGES] + 4 * (second & ~PARENT_EXTRA)
+        while True:
+            value = struct.unpack_from(">I", self.data, edge)[0]
+            parents.append(value & ~PARENT_EXTRA)
+            if value & PARENT_EXTRA:
+                return parents
+            edge += 4
+
+    def generation(self, pos):
+        return self._commit_data(pos)[3] >> 2
+
+    def date(self, pos):
+        _, _, _, high, low = self._commit_data(pos)
+        return ((high & 3) << 32) | low
+
+
+def repo_commit_graph(repo):
+    """Return the repository's CommitGraph, or None when it has none"""
+    if repo.commit_graph is None:
+        path = repo.repo_path("objects", "info", "commit-graph")
+        repo.commit_graph = CommitGraph(path) if os.path.exists(path) else False
+    return repo.commit_graph or None
+
+
+def commit_info(repo, sha):
+    """Return (parents, committer date, generation) for a commit
+
+    Commits in the commit-graph are answered from it without touching the
+    object database; generation is None for commits that are not.
+    """
+    graph = repo_commit_graph(repo)
+    if graph:
+        pos = graph.find(sha)
+        if pos is not None:
+            parents = [graph.oid(p) for p in graph.parents(pos)]
+            return parents, graph.date(pos), graph.generation(pos)
+
+    from base import object_read
+    commit = object_read(repo, sha)
+    if commit.fmt != b"commit":
+        raise Exception(f"{sha} is not a commit")
+    parents, date = commit_parse_summary(commit)
+    return parents, date, None
+
+
+def commit_graph_write(repo, tips):
+    """Write a commit-graph covering every commit reachable from tips
+
+    Returns the number of commits written.
+    """
+    from base import object_read
+
+    commits = {}
+    stack = list(tips)
+    while stack:
+        sha = stack.pop()
+        if sha in commits:
+            continue
+        commit = object_read(repo, sha)
+        if commit.fmt != b"commit":
+            continue
+        parents, date = commit_parse_summary(commit)
+        commits[sha] = (commit.header("tree"), parents, date)
+        stack.extend(p for p in parents if p not in commits)
+
+    order = sorted(commits)
+    position = {sha: i for i, sha in enumerate(order)}
+
+    # Topological levels: roots are 1, everything else one above its parents
+    generation = {}
+    for sha in order:
+        stack = [sha]
+        while stack:
+            current = stack[-1]
+            if current in generation:
+                stack.pop()
+                continue
+            missing = [p for p in commits[current][1] if p not in generation]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            level = 1 + max((generation[p] for p in commits[current][1]), default=0)
+            generation[current] = min(level, GENERATION_MAX)
+
+    fanout = [0] * 256
+    for sha in order:
+        fanout[int(sha[0:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    commit_data = []
+    edges = []
+    for sha in order:
+        tree, parents, date = commits[sha]
+        slots = [position[p] for p in parents]
+        first = slots[0] if slots else PARENT_NONE
+        if len(slots) <= 1:
+            second = PARENT_NONE
+        elif len(slots) == 2:
+            second = slots[1]
+        else:
+            second = PARENT_EXTRA | len(edges)
+            edges.extend(slots[1:-1])
+            edges.append(PARENT_EXTRA | slots[-1])
+        commit_data.append(COMMIT_DATA.pack(
+            bytes.fromhex(tree), first, second,
+            (generation[sha] << 2) | ((date >> 32) & 3), date & 0xFFFFFFFF,
+        ))
+
+    chunks = [
+        (CHUNK_OID_FANOUT, struct.pack(">256I", *fanout)),
+        (CHUNK_OID_LOOKUP, b"".join(bytes.fromhex(sha) for sha in order)),
+        (CHUNK_COMMIT_DATA, b"".join(commit_data)),
+    ]
+    if edges:
+        chunks.append((CHUNK_EXTRA_EDGES, b"".join(struct.pack(">I", e) for e in edges)))
+
+    header = struct.pack(">4sBBBB", GRAPH_SIGNATURE, 1, 1, len(chunks), 0)
+    offset = len(header) + 12 * (len(chunks) + 1)
+    table = []
+    for chunk_id, data in chunks:
+        table.append(struct.pack(">4sQ", chunk_id, offset))
+        offset += len(data)
+    table.append(struct.pack(">4sQ", b"\0\0\0\0", offset))
+
+    content = header + b"".join(table) + b"".join(data for _, data in chunks)
+    content += hashlib.sha1(content).digest()
+
+    info_dir = repo.repo_dir("objects", "info", mkdir=True)
+    fd, tmp_path = tempfile.mkstemp(prefix="tmp_graph_", dir=info_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, os.path.join(info_dir, "commit-graph"))
+
+    if repo.commit_graph:
+        repo.commit_graph.close()
+    repo.commit_graph = None
+    return len(order)
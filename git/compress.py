@@ -0,0 +1,43 @@
+import zlib
+
+
+# Leading bytes of formats that are already compressed: PNG, JPEG, GIF,
+# zip (also jar, docx, apk), gzip, bzip2, xz, zstd and 7z
+COMPRESSED_MAGIC = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"PK\x03\x04", b"\x1f\x8b",
+    b"BZh", b"\xfd7zXZ\x00", b"\x28\xb5\x2f\xfd", b"7z\xbc\xaf\x27\x1c",
+)
+
+# Blobs at least this large get a trial compression of their first chunk
+TRIAL_MIN_SIZE = 256 * 1024
+TRIAL_SAMPLE_SIZE = 64 * 1024
+
+# A sample that zlib cannot shrink below this fraction is stored as is
+INCOMPRESSIBLE_RATIO = 0.9
+
+
+def config_compression_level(conf, section, key, fallback):
+    """Read a zlib level (-1 for zlib's default, 0 to 9) from the config"""
+    level = conf.getint(section, key, fallback=fallback)
+    if level is not None and not -1 <= level <= 9:
+        raise Exception(f"bad zlib compression level {level}")
+    return level
+
+
+def blob_compression_level(level, sample, size):
+    """The zlib level to store a blob of size bytes that starts with sample
+
+    Content that is already compressed is stored at level 0, which costs
+    little more than a copy: either its header names a compressed format,
+    or, for large blobs, a fast trial compression of the first chunk barely
+    shrinks it.
+    """
+    if level == 0:
+        return 0
+    if sample.startswith(COMPRESSED_MAGIC):
+        return 0
+    if size >= TRIAL_MIN_SIZE:
+        sample = sample[:TRIAL_SAMPLE_SIZE]
+        if len(zlib.compress(sample, 1)) >= len(sample) * INCOMPRESSIBLE_RATIO:
+            return 0
+    return level
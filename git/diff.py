@@ -0,0 +1,152 @@
+import difflib
+from base import object_read
+from object import tree_entry_key
+
+
+# Git treats content with a NUL byte in its first 8000 bytes as binary
+BINARY_CHECK_SIZE = 8000
+
+# Widest +/- graph drawn by diff_stat_format
+STAT_GRAPH_WIDTH = 50
+
+
+def _is_tree(mode):
+    return mode.lstrip("0") == "40000"
+
+
+def _tree_entries(repo, sha):
+    """(mode, name, ObjectId) entries of a tree, in git order"""
+    if not sha:
+        return []
+    return sorted(object_read(repo, sha).entries(), key=lambda e: tree_entry_key(e[0], e[1]))
+
+
+def resolve_tree(repo, rev):
+    """Return the tree SHA named by rev, a commit or a tree"""
+    sha = repo.ref_resolve(rev)
+    obj = object_read(repo, sha)
+    if obj.fmt == b"commit":
+        return obj.header("tree")
+    if obj.fmt == b"tree":
+        return sha
+    raise Exception(f"{rev} is not a tree or commit")
+
+
+def tree_diff(repo, old_sha, new_sha, prefix="", recursive=True):
+    """Yield (path, old, new) for entries that differ between two trees
+
+    old and new are (mode, sha) pairs, or None where the entry is absent.
+    Both trees are walked together in git's sorted order, and a subtree
+    whose SHA is the same on both sides is skipped without being read, so
+    the cost follows the size of the change rather than of the trees.
+
+    With recursive, changed subtrees are descended into and only files are
+    reported; otherwise subtrees are reported as single entries. A file
+    that became a directory (or the reverse) is a removal plus additions.
+    """
+    if old_sha == new_sha:
+        return
+    old = _tree_entries(repo, old_sha)
+    new = _tree_entries(repo, new_sha)
+
+    i = j = 0
+    while i < len(old) or j < len(new):
+        old_key = tree_entry_key(old[i][0], old[i][1]) if i < len(old) else None
+        new_key = tree_entry_key(new[j][0], new[j][1]) if j < len(new) else None
+
+        if new_key is None or (old_key is not None and old_key < new_key):
+            before, after, name = old[i], None, old[i][1]
+            i += 1
+        elif old_key is None or new_key < old_key:
+            before, after, name = None, new[j], new[j][1]
+            j += 1
+        else:
+            before, after, name = old[i], new[j], old[i][1]
+            i += 1
+            j += 1
+            # Binary IDs compare without converting either side to hex
+            if before[0] == after[0] and before[2] == after[2]:
+                continue
+
+        path = prefix + name
+        before = (before[0], str(before[2])) if before else None
+        after = (after[0], str(after[2])) if after else None
+        entry = before or after
+        if recursive and _is_tree(entry[0]):
+            yield from tree_diff(
+                repo, before and before[1], after and after[1], path + "/"
+            )
+        else:
+            yield path, before, after
+
+
+def change_status(old, new):
+    """Git's one-letter status for a change: A, D or M"""
+    if old is None:
+        return "A"
+    if new is None:
+        return "D"
+    return "M"
+
+
+def _blob(repo, entry):
+    if entry is None or _is_tree(entry[0]) or entry[0] == "160000":
+        return b""
+    return bytes(object_read(repo, entry[1]).blobdata)
+
+
+def diff_stat(repo, changes):
+    """Return (path, insertions, deletions, binary) for each change
+
+    Line counts come from a line diff of the two blobs; binary files only
+    report that they changed.
+    """
+    stats = []
+    for path, old, new in changes:
+        before = _blob(repo, old)
+        after = _blob(repo, new)
+        if b"\x00" in before[:BINARY_CHECK_SIZE] or b"\x00" in after[:BINARY_CHECK_SIZE]:
+            stats.append((path, 0, 0, True))
+            continue
+
+        a = before.splitlines()
+        b = after.splitlines()
+        insertions = deletions = 0
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+            if tag != "equal":
+                deletions += i2 - i1
+                insertions += j2 - j1
+        stats.append((path, insertions, deletions, False))
+    return stats
+
+
+def diff_stat_format(stats):
+    """Render diff_stat results the way git diff --stat does"""
+    if not stats:
+        return ""
+    name_width = max(len(path) for path, _, _, _ in stats)
+    largest = max(ins + dels for _, ins, dels, _ in stats)
+    count_width = len(str(largest))
+    scale = min(1.0, STAT_GRAPH_WIDTH / largest) if largest else 1.0
+
+    lines = []
+    total_ins = total_dels = 0
+    for path, ins, dels, binary in stats:
+        if binary:
+            lines.append(f" {path.ljust(name_width)} | Bin\n")
+            continue
+        total_ins += ins
+        total_dels += dels
+        # Scaled down to fit, but any change still gets at least one mark
+        plus = max(1, int(ins * scale + 0.5)) if ins else 0
+        minus = max(1, int(dels * scale + 0.5)) if dels else 0
+        graph = "+" * plus + "-" * minus
+        lines.append(f" {path.ljust(name_width)} | {str(ins + dels).rjust(count_width)} {graph}".rstrip() + "\n")
+
+    summary = f" {len(stats)} file{'s' if len(stats) != 1 else ''} changed"
+    if total_ins or not total_dels:
+        summary += f", {total_ins} insertion{'s' if total_ins != 1 else ''}(+)"
+    if total_dels or not total_ins:
+        summary += f", {total_dels} deletion{'s' if total_dels != 1 else ''}(-)"
+    lines.append(summary + "\n")
+    return "".join(lines)
@@ -0,0 +1,266 @@
+import hashlib
+import os
+import struct
+from lockfile import lock_file, rollback_lock_file
+
+
+INDEX_SIGNATURE = b"DIRC"
+
+# ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size, SHA, flags
+ENTRY_HEADER = struct.Struct(">10I20sH")
+
+FLAG_EXTENDED = 0x4000
+NAME_MASK = 0x0FFF
+
+CACHE_TREE_SIGNATURE = b"TREE"
+
+
+class GitIndexEntry:
+    """One file recorded in the index, with the stat data it was hashed at"""
+
+    def __init__(self, path, sha, mode=0o100644, size=0, ctime=(0, 0),
+                 mtime=(0, 0), dev=0, ino=0, uid=0, gid=0, flags=0):
+        self.path = path
+        self.sha = sha
+        self.mode = mode
+        self.size = size
+        self.ctime = ctime
+        self.mtime = mtime
+        self.dev = dev
+        self.ino = ino
+        self.uid = uid
+        self.gid = gid
+        self.flags = flags
+
+    @classmethod
+    def from_stat(cls, path, sha, st, mode=0o100644):
+        return cls(
+            path, sha, mode=mode,
+            size=st.st_size & 0xFFFFFFFF,
+            ctime=divmod(st.st_ctime_ns, 10**9),
+            mtime=divmod(st.st_mtime_ns, 10**9),
+            dev=st.st_dev & 0xFFFFFFFF,
+            ino=st.st_ino & 0xFFFFFFFF,
+            uid=st.st_uid & 0xFFFFFFFF,
+            gid=st.st_gid & 0xFFFFFFFF,
+        )
+
+    def stat_matches(self, st):
+        """True when st describes the same file contents we last hashed"""
+        return (
+            self.size == st.st_size & 0xFFFFFFFF
+            and self.mtime == divmod(st.st_mtime_ns, 10**9)
+            and self.ctime == divmod(st.st_ctime_ns, 10**9)
+            and self.ino == st.st_ino & 0xFFFFFFFF
+            and self.dev == st.st_dev & 0xFFFFFFFF
+        )
+
+
+class CacheTree:
+    """One directory of the cache-tree (TREE) index extension
+
+    Records the tree SHA last written for the directory and how many index
+    entries it covers. sha is None once an entry below it has changed.
+    """
+
+    def __init__(self, name="", entry_count=-1, sha=None):
+        self.name = name
+        self.entry_count = entry_count
+        self.sha = sha
+        self.children = {}
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = CacheTree(name)
+        return node
+
+    def invalidate(self, path):
+        """Invalidate every directory on the way to path"""
+        node = self
+        parts = path.split("/")[:-1]
+        while node is not None:
+            node.sha = None
+            node.entry_count = -1
+            if not parts:
+                break
+            node = node.children.get(parts.pop(0))
+
+
+def cache_tree_parse(data):
+    """Parse TREE extension data into a CacheTree"""
+    def parse(pos):
+        name_end = data.index(b"\x00", pos)
+        line_end = data.index(b"\n", name_end)
+        count, subtrees = data[name_end + 1:line_end].split(b" ")
+        node = CacheTree(data[pos:name_end].decode("utf8"), int(count))
+        pos = line_end + 1
+        if node.entry_count >= 0:
+            node.sha = data[pos:pos + 20].hex()
+            pos += 20
+        for _ in range(int(subtrees)):
+            child, pos = parse(pos)
+            node.children[child.name] = child
+        return node, pos
+
+    return parse(0)[0]
+
+
+def cache_tree_serialize(node):
+    parts = []
+
+    def walk(node):
+        parts.append(node.name.encode("utf8") + b"\x00")
+        parts.append(f"{node.entry_count} {len(node.children)}\n".encode("ascii"))
+        if node.sha is not None:
+            parts.append(bytes.fromhex(node.sha))
+        # git keeps subtrees ordered by name length first, then bytes
+        for name in sorted(node.children, key=lambda n: (len(n.encode("utf8")), n.encode("utf8"))):
+            walk(node.children[name])
+
+    walk(node)
+    return b"".join(parts)
+
+
+class GitIndex:
+    """The staging area (.git/index), keyed by worktree-relative path"""
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+        # Root of the TREE extension; starts out fully invalid
+        self.cache_tree = CacheTree()
+        # mtime of the index file when it was read, for racy-git checks
+        self.mtime = None
+        self.dirty = False
+
+    def is_racy(self, entry):
+        """Entries modified no earlier than the index itself can't be trusted
+
+        A file changed in the same timestamp granule as the index was written
+        may still have matching stat data, so it has to be rehashed.
+        """
+        return self.mtime is None or entry.mtime >= self.mtime
+
+    def lookup_clean(self, path, st):
+        """Return the recorded SHA for path if its stat data is unchanged"""
+        entry = self.entries.get(path)
+        if entry and entry.stat_matches(st) and not self.is_racy(entry):
+            return entry.sha
+        return None
+
+    def update(self, path, sha, st, mode=0o100644):
+        old = self.entries.get(path)
+        self.entries[path] = GitIndexEntry.from_stat(path, sha, st, mode=mode)
+        if old is None or old.sha != sha or old.mode != mode:
+            self.cache_tree.invalidate(path)
+        self.dirty = True
+
+    def remove(self, path, invalidate=True):
+        if self.entries.pop(path, None) is not None:
+            if invalidate:
+                self.cache_tree.invalidate(path)
+            self.dirty = True
+
+
+def index_read(repo):
+    """Read .git/index, returning an empty index if there is none"""
+    path = repo.repo_file("index")
+    index = GitIndex()
+    if not path or not os.path.exists(path):
+        return index
+
+    with open(path, "rb") as f:
+        data = f.read()
+        st = os.fstat(f.fileno())
+    index.mtime = divmod(st.st_mtime_ns, 10**9)
+
+    if len(data) < 32 or hashlib.sha1(data[:-20]).digest() != data[-20:]:
+        raise Exception("Index file is corrupt (bad checksum)")
+    signature, version, count = struct.unpack_from(">4sII", data, 0)
+    if signature != INDEX_SIGNATURE:
+        raise Exception("Index file has a bad signature")
+    if version not in (2, 3):
+        raise Exception(f"Unsupported index version {version}")
+
+    pos = 12
+    for _ in range(count):
+        fields = ENTRY_HEADER.unpack_from(data, pos)
+        flags = fields[11]
+        name_start = pos + ENTRY_HEADER.size
+        if flags & FLAG_EXTENDED:
+            name_start += 2
+        name_end = data.index(b"\x00", name_start)
+        name = data[name_start:name_end].decode("utf8")
+
+        entry = GitIndexEntry(
+            name, fields[10].hex(), mode=fields[6], size=fields[9],
+            ctime=(fields[0], fields[1]), mtime=(fields[2], fields[3]),
+            dev=fields[4], ino=fields[5], uid=fields[7], gid=fields[8],
+            flags=flags,
+        )
+        index.entries[name] = entry
+
+        # Entries are NUL padded to a multiple of eight bytes
+        pos += (name_end - pos + 8) & ~7
+
+    # Extensions follow the entries; unknown ones are dropped
+    while pos < len(data) - 20:
+        signature, size = struct.unpack_from(">4sI", data, pos)
+        pos += 8
+        if signature == CACHE_TREE_SIGNATURE:
+            index.cache_tree = cache_tree_parse(data[pos:pos + size])
+        elif not b"A" <= signature[0:1] <= b"Z":
+            raise Exception(f"Unsupported index extension {signature!r}")
+        pos += size
+
+    return index
+
+
+def index_serialize(index):
+    """Serialize an index in version 2 format, including the checksum"""
+    entries = sorted(index.entries.values(), key=lambda e: e.path.encode("utf8"))
+    parts = [struct.pack(">4sII", INDEX_SIGNATURE, 2, len(entries))]
+    for e in entries:
+        name = e.path.encode("utf8")
+        flags = (e.flags & ~(NAME_MASK | FLAG_EXTENDED)) | min(len(name), NAME_MASK)
+        header = ENTRY_HEADER.pack(
+            e.ctime[0], e.ctime[1], e.mtime[0], e.mtime[1], e.dev, e.ino,
+            e.mode, e.uid, e.gid, e.size, bytes.fromhex(e.sha), flags,
+        )
+        length = ENTRY_HEADER.size + len(name)
+        parts.append(header + name + b"\x00" * (8 - length % 8))
+
+    tree = cache_tree_serialize(index.cache_tree)
+    parts.append(CACHE_TREE_SIGNATURE + struct.pack(">I", len(tree)) + tree)
+
+    data = b"".join(parts)
+    return data + hashlib.sha1(data).digest()
+
+
+def index_lock(repo):
+    """Take index.lock, for callers that must hold it before changing the worktree"""
+    return lock_file(repo.repo_file("index"))
+
+
+def index_unlock(repo, lock):
+    rollback_lock_file(lock, repo.repo_file("index"))
+
+
+def index_write(repo, index, lock=None):
+    """Atomically replace .git/index, failing if another writer holds the lock
+
+    lock is a descriptor from index_lock when the caller already holds it.
+    """
+    path = repo.repo_file("index")
+    lock_path = path + ".lock"
+    fd = index_lock(repo) if lock is None else lock
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(index_serialize(index))
+        os.replace(lock_path, path)
+    except BaseException:
+        if os.path.exists(lock_path):
+            os.unlink(lock_path)
+        raise
+    index.dirty = False
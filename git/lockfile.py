@@ -0,0 +1,45 @@
+import os
+
+
+def lock_file(path):
+    """Create path + ".lock" exclusively and return its descriptor
+
+    The lock file doubles as the new content: it is written, synced and
+    renamed over path by commit_lock_file, or removed by rollback_lock_file.
+    """
+    lock_path = path + ".lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    try:
+        return os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        raise Exception(f"Unable to create '{lock_path}': File exists")
+
+
+def write_lock_file(fd, data):
+    """Write data to a held lock file and flush it to disk"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+    os.fsync(fd)
+
+
+def commit_lock_file(fd, path):
+    os.close(fd)
+    os.replace(path + ".lock", path)
+
+
+def rollback_lock_file(fd, path):
+    os.close(fd)
+    try:
+        os.unlink(path + ".lock")
+    except FileNotFoundError:
+        pass
+
+
+def fsync_dir(path):
+    """Make renames into a directory durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
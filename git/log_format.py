@@ -0,0 +1,125 @@
+import re
+
+
+# Placeholders understood by --format, as in git's pretty formats
+PLACEHOLDER = re.compile(r"%(an|ae|ad|at|cn|ce|cd|ct|H|h|P|p|T|t|s|b|n|%)")
+
+# Placeholders that can be answered without reading the commit object
+WALK_PLACEHOLDERS = {"H", "h", "P", "p", "n", "%"}
+
+PRESETS = {
+    "oneline": "%h %s",
+    "short": "commit %H%nAuthor: %an <%ae>%n%n    %s%n",
+}
+
+
+def split_person(value):
+    """Split an author/committer line into (name, email, date)"""
+    name, sep, rest = value.partition(" <")
+    if not sep:
+        return value, "", ""
+    email, _, date = rest.partition(">")
+    return name, email, date.strip()
+
+
+def split_message(message):
+    """Return (subject, body) of a commit message"""
+    subject, _, body = message.strip("\n").partition("\n")
+    return subject, body.strip("\n")
+
+
+def compile_template(template):
+    """Split a --format template into (is_placeholder, text) pieces"""
+    pieces = []
+    pos = 0
+    for match in PLACEHOLDER.finditer(template):
+        if match.start() > pos:
+            pieces.append((False, template[pos:match.start()]))
+        pieces.append((True, match.group(1)))
+        pos = match.end()
+    if pos < len(template):
+        pieces.append((False, template[pos:]))
+    return pieces
+
+
+class LogFormatter:
+    """Render commits into text for log
+
+    A template is split into literal text and placeholders once, so each
+    commit is rendered with one pass over a short list and a single join.
+    pretty is a preset name, "medium" (the default layout), or a template.
+    """
+
+    def __init__(self, pretty="medium"):
+        self.medium = pretty == "medium"
+        self.pieces = [] if self.medium else compile_template(PRESETS.get(pretty, pretty))
+        self.needs_commit = self.medium or any(
+            is_field and value not in WALK_PLACEHOLDERS for is_field, value in self.pieces
+        )
+
+    def render(self, sha, parents, commit=None):
+        """Return the text for one commit, ending in a newline"""
+        if self.medium:
+            return self._render_medium(sha, parents, commit)
+        fields = _Fields(sha, parents, commit)
+        out = [fields[value] if is_field else value for is_field, value in self.pieces]
+        out.append("\n")
+        return "".join(out)
+
+    def _render_medium(self, sha, parents, commit):
+        lines = [f"commit {sha}\n"]
+        if len(parents) > 1:
+            lines.append("Merge: " + " ".join(p[:7] for p in parents) + "\n")
+        lines.append(f"Author: {commit.header('author', 'Unknown')}\n")
+
+        committer = commit.header("committer", "Unknown")
+        if ">" in committer:
+            committer = committer.split(">")[1].strip()
+        lines.append(f"Date:   {committer}\n\n")
+
+        message = commit.message.strip()
+        for line in message.split("\n"):
+            lines.append(f"    {line}\n" if line else "\n")
+        lines.append("\n")
+        return "".join(lines)
+
+
+class _Fields:
+    """Placeholder values for one commit, computed on demand"""
+
+    def __init__(self, sha, parents, commit):
+        self.sha = sha
+        self.parents = parents
+        self.commit = commit
+
+    def __getitem__(self, key):
+        if key == "H":
+            return self.sha
+        if key == "h":
+            return self.sha[:7]
+        if key == "P":
+            return " ".join(self.parents)
+        if key == "p":
+            return " ".join(p[:7] for p in self.parents)
+        if key == "n":
+            return "\n"
+        if key == "%":
+            return "%"
+
+        commit = self.commit
+        if key == "T":
+            return commit.header("tree", "")
+        if key == "t":
+            return commit.header("tree", "")[:7]
+        if key in ("s", "b"):
+            subject, body = split_message(commit.message)
+            return subject if key == "s" else body
+
+        name, email, date = split_person(commit.header("author" if key[0] == "a" else "committer", ""))
+        if key[1] == "n":
+            return name
+        if key[1] == "e":
+            return email
+        if key[1] == "t":
+            return date.split(" ")[0]
+        return date
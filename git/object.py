@@ -1,11 +1,40 @@
+import bisect
+import re
+import sys
 import zlib
 import time
 
 
+# One tree entry: mode, space, path, NUL, binary SHA
+TREE_ENTRY = re.compile(rb"([0-7]+) ([^\x00]*)\x00(.{20})", re.DOTALL)
+
+
+class ObjectId(bytes):
+    """A 20-byte binary object ID
+
+    Half the size of the 40-character hex form and compared as plain bytes;
+    str() gives the hex form back.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_hex(cls, sha):
+        return cls(bytes.fromhex(sha))
+
+    def __str__(self):
+        return self.hex()
+
+    def __repr__(self):
+        return f"ObjectId({self.hex()!r})"
+
+
 class GitObject:
+    __slots__ = ("repo",)
+
     def __init__(self, repo, data=None):
         self.repo = repo
-        if data:
+        if data is not None:
             self.deserialize(data)
 
     def serialize(self):
@@ -16,6 +45,7 @@ class GitObject:
 
 
 class GitBlob(GitObject):
+    __slots__ = ("blobdata",)
     fmt = b"blob"
 
     def serialize(self):
@@ -25,132 +55,293 @@ class GitBlob(GitObject):
         self.blobdata = data
 
 
+def tree_entry_key(mode, path):
+    """Sort key for tree entries: git compares directories as "name/" """
+    return path + "/" if mode.lstrip("0") == "40000" else path
+
+
 class GitTree(GitObject):
+    """A directory listing
+
+    Entries are held in parallel arrays rather than a tuple per entry:
+    modes (interned, so shared between entries), names, and one bytearray
+    with the 20-byte SHAs back to back. Read trees keep their raw content
+    until an entry is first needed.
+    """
+
+    __slots__ = ("data", "modes", "names", "shas")
     fmt = b"tree"
 
     def __init__(self, repo, data=None):
-        self.items = []
+        # Raw tree content while the entries are still unparsed
+        self.data = None
+        self.modes = []
+        self.names = []
+        self.shas = bytearray()
         super().__init__(repo, data)
 
     def deserialize(self, data):
-        """Parse tree content from data"""
+        """Remember tree content; entries are parsed on demand
+
+        data may be bytes or a memoryview slice of a larger buffer; entries
+        are matched in place so the buffer itself is never copied.
+        """
+        self.data = data
+        self.modes = self.names = self.shas = None
+
+    @staticmethod
+    def _scan(data):
         i = 0
-        while i < len(data):
-            # Find the space terminator for the mode
-            mode_end = data.find(b' ', i)
-            if mode_end == -1:
-                raise Exception("Tree parse error: could not find mode terminator")
-            
-            # Read the mode
-            mode = data[i:mode_end].decode("ascii")
-            
-            # Find the NULL terminator for the path
-            path_end = data.find(b'\x00', mode_end)
-            if path_end == -1:
-                raise Exception("Tree parse error: could not find path terminator")
-            
-            # Read the path
-            path = data[mode_end+1:path_end].decode("utf8")
-            
-            # Read the SHA
-            sha_start = path_end + 1
-            sha_end = sha_start + 20
-            sha = data[sha_start:sha_end]
-            
-            # Convert binary SHA to hex string
-            hex_sha = ''.join([f"{b:02x}" for b in sha])
-            
-            self.items.append((mode, path, hex_sha))
-            
-            # Move to the next record
-            i = sha_end
+        end = len(data)
+        while i < end:
+            # Match "<mode> <path>\0<20-byte SHA>" at the current position
+            match = TREE_ENTRY.match(data, i)
+            if not match:
+                raise Exception(f"Tree parse error at offset {i}")
+            yield match
+            i = match.end()
+
+    def _load(self):
+        """Parse the raw content into the entry arrays"""
+        if self.names is not None:
+            return
+        modes = []
+        names = []
+        shas = bytearray()
+        for match in self._scan(self.data):
+            modes.append(sys.intern(match.group(1).decode("ascii")))
+            names.append(match.group(2).decode("utf8"))
+            shas += match.group(3)
+        self.modes, self.names, self.shas = modes, names, shas
+        self.data = None
+
+    @property
+    def items(self):
+        """A tuple of (mode, path, hex SHA) entries
+
+        It is immutable so that code still appending to it fails loudly;
+        change the tree with add() and sort(), or assign a new list.
+        """
+        return tuple(self)
+
+    @items.setter
+    def items(self, items):
+        self.modes, self.names, self.shas = [], [], bytearray()
+        self.data = None
+        for mode, path, sha in items:
+            self.add(mode, path, sha)
+
+    def add(self, mode, path, sha):
+        """Append an entry; sha is a hex string or binary ObjectId"""
+        self._load()
+        if isinstance(sha, str):
+            sha = bytes.fromhex(sha)
+        self.modes.append(sys.intern(mode))
+        self.names.append(path)
+        self.shas += sha
+
+    def sort(self):
+        """Put entries in git order (directories compare as "name/")"""
+        self._load()
+        modes, names, shas = self.modes, self.names, self.shas
+        order = sorted(range(len(names)), key=lambda i: tree_entry_key(modes[i], names[i]))
+        self.modes = [modes[i] for i in order]
+        self.names = [names[i] for i in order]
+        self.shas = bytearray().join(shas[20 * i:20 * i + 20] for i in order)
+
+    def oid(self, i):
+        """Binary SHA of entry i"""
+        self._load()
+        return ObjectId(self.shas[20 * i:20 * i + 20])
+
+    def entry(self, i):
+        """Entry i as (mode, path, hex SHA)"""
+        self._load()
+        return self.modes[i], self.names[i], self.shas[20 * i:20 * i + 20].hex()
+
+    def entries(self):
+        """Iterate entries as (mode, path, ObjectId)"""
+        self._load()
+        for i, (mode, path) in enumerate(zip(self.modes, self.names)):
+            yield mode, path, ObjectId(self.shas[20 * i:20 * i + 20])
+
+    def __iter__(self):
+        """Iterate (mode, path, hex SHA) without parsing into the arrays"""
+        if self.names is None:
+            return (
+                (m.group(1).decode("ascii"), m.group(2).decode("utf8"), m.group(3).hex())
+                for m in self._scan(self.data)
+            )
+        return (self.entry(i) for i in range(len(self.names)))
+
+    def __len__(self):
+        self._load()
+        return len(self.names)
+
+    def find(self, name):
+        """Return the (mode, path, hex SHA) entry called name, or None
+
+        Entries are in git order, so this is a binary search; name may be a
+        file or a directory.
+        """
+        self._load()
+        modes, names = self.modes, self.names
+        for key in (name, name + "/"):
+            i = bisect.bisect_left(range(len(names)), key, key=lambda j: tree_entry_key(modes[j], names[j]))
+            if i < len(names) and tree_entry_key(modes[i], names[i]) == key:
+                return self.entry(i)
+        return None
 
     def serialize(self):
         """Convert this tree to serialized form"""
-        result = b''
-        for mode, path, sha in self.items:
-            result += f"{mode} {path}".encode("utf8") + b'\x00'
-            # Convert hex SHA to binary
-            sha_binary = bytes.fromhex(sha)
-            result += sha_binary
-        return result
+        if self.names is None:
+            return bytes(self.data)
+        shas = memoryview(self.shas)
+        return b"".join(
+            b"%s %s\x00%s" % (mode.encode("ascii"), path.encode("utf8"), shas[20 * i:20 * i + 20])
+            for i, (mode, path) in enumerate(zip(self.modes, self.names))
+        )
+
+
+# Headers git expects first, in this order
+COMMIT_HEADER_ORDER = ("tree", "parent", "author", "committer")
 
 
 class GitCommit(GitObject):
+    """A commit, parsed lazily from its raw content
+
+    Reading a commit only keeps the raw bytes. The first header access
+    records where each header's value lies, and values are decoded only
+    when asked for, so a walk that needs parents decodes nothing else.
+    kvlm gives the fully decoded dict; assigning it replaces the content.
+    """
+
+    __slots__ = ("raw", "_kvlm", "_headers", "_message_start")
     fmt = b"commit"
 
+    def __init__(self, repo, data=None):
+        self.raw = None
+        self._kvlm = None
+        self._headers = None
+        self._message_start = 0
+        super().__init__(repo, data)
+
     def deserialize(self, data):
-        """Parse commit data"""
-        self.kvlm = self.parse_kvlm(data)
+        """Keep the commit data; headers are parsed on demand"""
+        self.raw = bytes(data)
+        self._kvlm = None
+        self._headers = None
 
     def serialize(self):
         """Convert this commit to serialized form"""
+        if self._kvlm is None and self.raw is not None:
+            return self.raw
         return self.kvlm_serialize(self.kvlm)
 
-    def parse_kvlm(self, raw):
-        """Parse key-value list with message"""
-        result = {}
-        
-        # Parse until the first blank line
-        i = 0
-        while i < len(raw):
-            # Find the next space (separating key and value)
-            space_pos = raw.find(b' ', i)
-            if space_pos == -1:
-                # No more keys
-                break
-                
-            # Find the end of the line
-            newline_pos = raw.find(b'\n', i)
-            if newline_pos == -1 or newline_pos < space_pos:
-                # Malformed line
+    def _index(self):
+        """Map each header key to the (start, end) spans of its values"""
+        if self._headers is not None:
+            return self._headers
+
+        raw = self.raw or b""
+        headers = {}
+        spans = None
+        pos = 0
+        end = len(raw)
+        while pos < end:
+            newline = raw.find(b"\n", pos)
+            if newline == -1:
+                newline = end
+            if newline == pos:
+                # A blank line separates the headers from the message
+                pos += 1
                 break
-                
-            # Extract key and value
-            key = raw[i:space_pos].decode('utf8')
-            value = raw[space_pos+1:newline_pos].decode('utf8')
-            
-            # If this is a known multi-line field, handle it differently
-            if key in result:
-                # If the field already exists, turn it into a list
-                if isinstance(result[key], list):
-                    result[key].append(value)
-                else:
-                    result[key] = [result[key], value]
+            if raw[pos] == 0x20 and spans:
+                # Continuation line of a multi-line value such as gpgsig
+                spans[-1] = (spans[-1][0], newline)
             else:
-                result[key] = value
-                
-            # Move to the next line
-            i = newline_pos + 1
-        
-        # Find the blank line that separates headers from message
-        message_start = raw.find(b'\n\n', 0) + 2
-        if message_start >= 2:  # Make sure we found a double newline
-            result['_message'] = raw[message_start:].decode('utf8')
-        else:
-            result['_message'] = ''
-            
-        return result
+                space = raw.find(b" ", pos, newline)
+                if space == -1:
+                    raise Exception(f"Malformed commit header at offset {pos}")
+                spans = headers.setdefault(raw[pos:space], [])
+                spans.append((space + 1, newline))
+            pos = newline + 1
+
+        self._headers = headers
+        self._message_start = pos
+        return headers
+
+    def _decode(self, span):
+        # Continuation lines carry one leading space that is not part of the value
+        return self.raw[span[0]:span[1]].decode("utf8").replace("\n ", "\n")
+
+    def header(self, key, default=None):
+        """Return one header's value; repeated headers come back as a list"""
+        if self._kvlm is not None:
+            return self._kvlm.get(key, default)
+        spans = self._index().get(key.encode("utf8"))
+        if not spans:
+            return default
+        if len(spans) == 1:
+            return self._decode(spans[0])
+        return [self._decode(span) for span in spans]
+
+    @property
+    def parents(self):
+        """Parent SHAs as a list, whatever their number"""
+        if self._kvlm is not None:
+            parents = self._kvlm.get("parent") or []
+            return [parents] if isinstance(parents, str) else list(parents)
+        raw = self.raw
+        return [raw[start:end].decode("ascii") for start, end in self._index().get(b"parent", ())]
+
+    @property
+    def message(self):
+        if self._kvlm is not None:
+            return self._kvlm.get("_message", "")
+        self._index()
+        return (self.raw or b"")[self._message_start:].decode("utf8")
+
+    @property
+    def kvlm(self):
+        """Every header and the message as a dict (decodes everything)"""
+        if self._kvlm is None:
+            kvlm = {}
+            for key in self._index():
+                name = key.decode("utf8")
+                kvlm[name] = self.header(name)
+            kvlm["_message"] = self.message
+            self._kvlm = kvlm
+        return self._kvlm
+
+    @kvlm.setter
+    def kvlm(self, kvlm):
+        self._kvlm = kvlm
+        self.raw = None
+        self._headers = None
 
     def kvlm_serialize(self, kvlm):
-        """Serialize KVLM to bytes"""
-        result = b''
-        
-        # Serialize keys and values
-        for key, value in kvlm.items():
-            if key == '_message':
-                continue  # Skip message for now
-                
-            if isinstance(value, list):
-                for v in value:
-                    result += key.encode('utf8') + b' ' + v.encode('utf8') + b'\n'
-            else:
-                result += key.encode('utf8') + b' ' + value.encode('utf8') + b'\n'
-                
-        # Add empty line and message
-        result += b'\n' + kvlm.get('_message', '').encode('utf8')
-        
-        return result
+        """Serialize KVLM to bytes
+
+        tree, parent, author and committer come first, as git requires;
+        newlines inside values are written as continuation lines.
+        """
+        keys = [key for key in COMMIT_HEADER_ORDER if key in kvlm]
+        keys += [key for key in kvlm if key not in COMMIT_HEADER_ORDER and key != "_message"]
+
+        lines = []
+        for key in keys:
+            values = kvlm[key]
+            if values is None:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                value = value.replace("\n", "\n ")
+                lines.append(f"{key} {value}\n")
+        lines.append("\n")
+        lines.append(kvlm.get("_message", ""))
+        return "".join(lines).encode("utf8")
 
     @staticmethod
     def create(repo, tree, parent, author, committer, message):
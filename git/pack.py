@@ -0,0 +1,696 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from compress import TRIAL_SAMPLE_SIZE, blob_compression_level
+from lockfile import fsync_dir
+
+
+# Object type numbers used in pack entry headers
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {
+    OBJ_COMMIT: b"commit",
+    OBJ_TREE: b"tree",
+    OBJ_BLOB: b"blob",
+    OBJ_TAG: b"tag",
+}
+
+TYPE_NUMBERS = {name: number for number, name in TYPE_NAMES.items()}
+
+IDX_MAGIC = b"\377tOc"
+FANOUT_SIZE = 256 * 4
+
+# Delta search parameters for the pack writer
+DELTA_BLOCK = 16
+DELTA_MAX_SIZE = 1 << 20
+
+
+def _map_file(path):
+    """Map a whole file read-only; pages are only faulted in when touched"""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PackIndex:
+    """A version 2 pack index (.idx file), accessed through mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = _map_file(path)
+
+        if self.data[0:4] != IDX_MAGIC:
+            raise Exception(f"Unsupported pack index (version 1?): {path}")
+        version = struct.unpack_from(">I", self.data, 4)[0]
+        if version != 2:
+            raise Exception(f"Unsupported pack index version {version}")
+
+        self.fanout = struct.unpack_from(">256I", self.data, 8)
+        self.count = self.fanout[255]
+
+        # Tables follow the fanout: sorted SHAs, CRC32s, 4-byte offsets and
+        # finally the 8-byte offsets for packs larger than 2GB
+        self.sha_table = 8 + FANOUT_SIZE
+        self.crc_table = self.sha_table + 20 * self.count
+        self.offset_table = self.crc_table + 4 * self.count
+        self.large_offset_table = self.offset_table + 4 * self.count
+
+    def sha_at(self, i):
+        start = self.sha_table + 20 * i
+        return self.data[start:start + 20]
+
+    def offset_at(self, i):
+        offset = struct.unpack_from(">I", self.data, self.offset_table + 4 * i)[0]
+        if offset & 0x80000000:
+            start = self.large_offset_table + 8 * (offset & 0x7FFFFFFF)
+            offset = struct.unpack_from(">Q", self.data, start)[0]
+        return offset
+
+    def find(self, binsha):
+        """Return the pack offset of a binary SHA, or None"""
+        first = self.fanout[binsha[0] - 1] if binsha[0] else 0
+        lo, hi = first, self.fanout[binsha[0]]
+
+        # The fanout narrows the search to SHAs sharing the first byte
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.sha_at(mid)
+            if current < binsha:
+                lo = mid + 1
+            elif current > binsha:
+                hi = mid
+            else:
+                return self.offset_at(mid)
+        return None
+
+    def close(self):
+        self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.sha_at(i), self.offset_at(i)
+
+
+class PackFile:
+    """A version 2 packfile together with its index
+
+    The pack is memory-mapped and compressed entries are handed to zlib as
+    memoryview slices, so reading an object only touches its own pages and
+    several processes can share one pack through the page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = PackIndex(path[:-len(".pack")] + ".idx")
+        self.map = _map_file(path)
+        self.view = memoryview(self.map)
+
+        if self.map[0:4] != b"PACK":
+            raise Exception(f"Not a packfile: {path}")
+        version, count = struct.unpack_from(">II", self.map, 4)
+        if version not in (2, 3):
+            raise Exception(f"Unsupported pack version {version}")
+        if count != self.index.count:
+            raise Exception(f"Pack and index disagree on object count: {path}")
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.index.close()
+
+    def __contains__(self, binsha):
+        return self.index.find(binsha) is not None
+
+    def entry_header(self, offset):
+        """Parse an entry header, returning (type, size, data_offset)"""
+        buf = self.map
+        c = buf[offset]
+        obj_type = (c >> 4) & 7
+        size = c & 0x0F
+        shift = 4
+        i = offset + 1
+        while c & 0x80:
+            c = buf[i]
+            size |= (c & 0x7F) << shift
+            shift += 7
+            i += 1
+        return obj_type, size, i
+
+    def _ofs_delta_base(self, offset):
+        """Decode the negative base offset of an OFS_DELTA entry"""
+        buf = self.map
+        c = buf[offset]
+        base = c & 0x7F
+        i = offset + 1
+        while c & 0x80:
+            c = buf[i]
+            base = ((base + 1) << 7) | (c & 0x7F)
+            i += 1
+        return base, i
+
+    def inflate(self, offset, size):
+        """Decompress one zlib stream starting at offset"""
+        d = zlib.decompressobj()
+        out = []
+        # Compressed data is rarely much larger than its output, so the
+        # first slice usually covers the whole stream
+        chunk = size + 64
+        pos = offset
+        while not d.eof:
+            piece = self.view[pos:pos + chunk]
+            if not piece:
+                raise Exception(f"Truncated pack entry at {offset} in {self.path}")
+            out.append(d.decompress(piece))
+            pos += len(piece)
+            chunk = 65536
+        data = b"".join(out)
+        if len(data) != size:
+            raise Exception(f"Malformed pack entry at {offset} in {self.path}")
+        return data
+
+    def read_at(self, offset, resolve_ref=None):
+        """Read the object at offset, returning (fmt, data)
+
+        Delta chains are followed iteratively so long chains do not hit the
+        recursion limit. resolve_ref is called with a binary SHA for
+        REF_DELTA bases that are not in this pack.
+        """
+        deltas = []
+        while True:
+            obj_type, size, data_offset = self.entry_header(offset)
+            if obj_type == OBJ_OFS_DELTA:
+                base, data_offset = self._ofs_delta_base(data_offset)
+                deltas.append(self.inflate(data_offset, size))
+                offset -= base
+            elif obj_type == OBJ_REF_DELTA:
+                base_sha = self.map[data_offset:data_offset + 20]
+                deltas.append(self.inflate(data_offset + 20, size))
+                base_offset = self.index.find(base_sha)
+                if base_offset is not None:
+                    offset = base_offset
+                    continue
+                if resolve_ref is None:
+                    raise Exception(f"Missing delta base {base_sha.hex()}")
+                fmt, data = resolve_ref(base_sha)
+                break
+            elif obj_type in TYPE_NAMES:
+                fmt = TYPE_NAMES[obj_type]
+                data = self.inflate(data_offset, size)
+                break
+            else:
+                raise Exception(f"Unknown pack object type {obj_type}")
+
+        for delta in reversed(deltas):
+            data = delta_apply(data, delta)
+        return fmt, data
+
+    def read(self, binsha, resolve_ref=None):
+        offset = self.index.find(binsha)
+        if offset is None:
+            return None
+        return self.read_at(offset, resolve_ref)
+
+    def _pieces(self, offset):
+        for pos in range(offset, len(self.map), 65536):
+            yield self.view[pos:pos + 65536]
+
+    def header_at(self, offset, resolve_ref_header=None):
+        """Return (fmt, size) of the object at offset without inflating it
+
+        Only the first bytes of an outermost delta are inflated, to learn
+        the result size; the type comes from walking the chain's headers.
+        """
+        size = None
+        while True:
+            obj_type, entry_size, data_offset = self.entry_header(offset)
+            if obj_type in TYPE_NAMES:
+                return TYPE_NAMES[obj_type], entry_size if size is None else size
+
+            if obj_type == OBJ_OFS_DELTA:
+                base, data_offset = self._ofs_delta_base(data_offset)
+                base_offset = offset - base
+            elif obj_type == OBJ_REF_DELTA:
+                base_sha = self.map[data_offset:data_offset + 20]
+                data_offset += 20
+                base_offset = self.index.find(base_sha)
+            else:
+                raise Exception(f"Unknown pack object type {obj_type}")
+
+            if size is None:
+                prefix = b"".join(inflate_chunks(self._pieces(data_offset), 32, limit=32))
+                _, i = _delta_varint(prefix, 0)
+                size, _ = _delta_varint(prefix, i)
+
+            if base_offset is None:
+                if resolve_ref_header is None:
+                    raise Exception(f"Missing delta base {base_sha.hex()}")
+                return resolve_ref_header(base_sha)[0], size
+            offset = base_offset
+
+    def stream_at(self, offset, chunk_size, resolve_ref=None):
+        """Yield (fmt, size) and then the object content in chunks
+
+        Whole objects are inflated incrementally; deltified objects have to
+        be rebuilt in memory first and are then handed out in slices.
+        """
+        obj_type, size, data_offset = self.entry_header(offset)
+        if obj_type in TYPE_NAMES:
+            yield TYPE_NAMES[obj_type], size
+            yield from inflate_chunks(self._pieces(data_offset), chunk_size)
+            return
+
+        fmt, data = self.read_at(offset, resolve_ref)
+        yield fmt, len(data)
+        view = memoryview(data)
+        for pos in range(0, len(data), chunk_size):
+            yield view[pos:pos + chunk_size]
+
+
+def inflate_chunks(pieces, chunk_size, limit=None):
+    """Inflate a zlib stream given as an iterable of compressed pieces
+
+    Yields the output in chunks of at most chunk_size bytes, so even a
+    stream that expands enormously is never held in memory at once. With
+    limit, stops after that many bytes instead of reading the stream to
+    the end.
+    """
+    d = zlib.decompressobj()
+    produced = 0
+    for piece in pieces:
+        buf = piece
+        while True:
+            out = d.decompress(buf, chunk_size)
+            if out:
+                produced += len(out)
+                yield out
+                if limit is not None and produced >= limit:
+                    return
+            buf = d.unconsumed_tail
+            if d.eof:
+                return
+            # A full chunk may leave output pending inside zlib
+            if not buf and len(out) < chunk_size:
+                break
+    raise Exception("Truncated zlib stream")
+
+
+def _delta_varint(delta, i):
+    value = 0
+    shift = 0
+    while True:
+        c = delta[i]
+        i += 1
+        value |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return value, i
+
+
+def delta_apply(base, delta):
+    """Rebuild an object from its base and a git delta"""
+    src_size, i = _delta_varint(delta, 0)
+    dst_size, i = _delta_varint(delta, i)
+    if src_size != len(base):
+        raise Exception("Delta base size mismatch")
+
+    out = []
+    n = len(delta)
+    while i < n:
+        op = delta[i]
+        i += 1
+        if op & 0x80:
+            # Copy a range of the base
+            offset = 0
+            size = 0
+            for bit in range(4):
+                if op & (1 << bit):
+                    offset |= delta[i] << (8 * bit)
+                    i += 1
+            for bit in range(3):
+                if op & (0x10 << bit):
+                    size |= delta[i] << (8 * bit)
+                    i += 1
+            if size == 0:
+                size = 0x10000
+            out.append(base[offset:offset + size])
+        elif op:
+            # Insert literal bytes from the delta
+            out.append(delta[i:i + op])
+            i += op
+        else:
+            raise Exception("Invalid delta opcode 0")
+
+    result = b"".join(out)
+    if len(result) != dst_size:
+        raise Exception("Delta result size mismatch")
+    return result
+
+
+def _delta_size_varint(n):
+    out = bytearray()
+    while True:
+        c = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(c | 0x80)
+        else:
+            out.append(c)
+            return bytes(out)
+
+
+def _delta_copy(offset, size):
+    """Encode a copy opcode; a size of 0x10000 is stored as zero"""
+    op = 0x80
+    args = bytearray()
+    for bit in range(4):
+        b = (offset >> (8 * bit)) & 0xFF
+        if b:
+            op |= 1 << bit
+            args.append(b)
+    for bit in range(3):
+        b = (size >> (8 * bit)) & 0xFF
+        if b:
+            op |= 0x10 << bit
+            args.append(b)
+    return bytes([op]) + bytes(args)
+
+
+def _delta_insert(out, target, start, end):
+    """Append insert opcodes for target[start:end], returning the bytes added"""
+    added = 0
+    while start < end:
+        n = min(end - start, 0x7F)
+        out.append(bytes([n]))
+        out.append(target[start:start + n])
+        start += n
+        added += n + 1
+    return added
+
+
+def delta_create(base, target, max_size=None):
+    """Encode target as a git delta against base
+
+    Base is indexed in fixed-size blocks; the target is scanned for block
+    matches which are then extended in both directions into copy opcodes.
+    With max_size, gives up and returns None as soon as the delta would
+    reach that many bytes, like git's max_size.
+    """
+    if max_size is None:
+        max_size = math.inf
+    out = [_delta_size_varint(len(base)), _delta_size_varint(len(target))]
+    size = len(out[0]) + len(out[1])
+    if size >= max_size:
+        return None
+
+    index = {}
+    for i in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        index.setdefault(base[i:i + DELTA_BLOCK], i)
+
+    n = len(target)
+    literal_start = 0
+    i = 0
+    while i + DELTA_BLOCK <= n:
+        offset = index.get(target[i:i + DELTA_BLOCK])
+        if offset is None:
+            i += 1
+            # The pending literal run costs at least its own length
+            if size + i - literal_start >= max_size:
+                return None
+            continue
+
+        # Grow the match backwards into the pending literal run
+        while i > literal_start and offset > 0 and base[offset - 1] == target[i - 1]:
+            i -= 1
+            offset -= 1
+
+        # Grow the match forwards, a slice at a time where possible
+        length = DELTA_BLOCK
+        while True:
+            step = min(256, n - i - length, len(base) - offset - length)
+            if step <= 0:
+                break
+            if target[i + length:i + length + step] == base[offset + length:offset + length + step]:
+                length += step
+                continue
+            while target[i + length] == base[offset + length]:
+                length += 1
+            break
+
+        size += _delta_insert(out, target, literal_start, i)
+        while length:
+            chunk = min(length, 0x10000)
+            out.append(_delta_copy(offset, chunk))
+            size += len(out[-1])
+            offset += chunk
+            i += chunk
+            length -= chunk
+        if size >= max_size:
+            return None
+        literal_start = i
+
+    size += _delta_insert(out, target, literal_start, n)
+    if size >= max_size:
+        return None
+    return b"".join(out)
+
+
+def _entry_header(obj_type, size):
+    c = (obj_type << 4) | (size & 0x0F)
+    size >>= 4
+    out = bytearray()
+    while size:
+        out.append(c | 0x80)
+        c = size & 0x7F
+        size >>= 7
+    out.append(c)
+    return bytes(out)
+
+
+def _ofs_encode(n):
+    out = bytearray([n & 0x7F])
+    n >>= 7
+    while n:
+        n -= 1
+        out.insert(0, 0x80 | (n & 0x7F))
+        n >>= 7
+    return bytes(out)
+
+
+def _choose_deltas(objects, window, depth):
+    """Pick a delta base for each object using a sliding window
+
+    Objects are sorted by type, name and decreasing size so that similar
+    objects sit next to each other; each one is tried against the previous
+    window objects of the same type. Returns a list of
+    (obj, base_obj or None, delta or None) in the order they must be written.
+    """
+    order = sorted(objects, key=lambda o: (o["type"], o["name"], -len(o["data"])))
+    chosen = []
+    depths = {}
+    for pos, obj in enumerate(order):
+        best_base = None
+        best_delta = None
+        data = obj["data"]
+        limit = len(data) // 2 - 20
+        if window and DELTA_BLOCK < len(data) <= DELTA_MAX_SIZE:
+            for base in order[max(0, pos - window):pos]:
+                if base["type"] != obj["type"] or depths[base["sha"]] >= depth:
+                    continue
+                if len(base["data"]) > DELTA_MAX_SIZE or abs(len(base["data"]) - len(data)) > limit:
+                    continue
+                # Only a delta smaller than the best so far is worth finishing
+                delta = delta_create(base["data"], data, limit if best_delta is None else len(best_delta))
+                if delta is not None:
+                    best_base, best_delta = base, delta
+        depths[obj["sha"]] = depths[best_base["sha"]] + 1 if best_base else 0
+        chosen.append((obj, best_base, best_delta))
+    return chosen
+
+
+def pack_write(pack_dir, objects, window=10, depth=50, compression=-1):
+    """Write objects into a new version 2 pack plus index
+
+    objects is an iterable of (fmt, data, name) where name is a path hint
+    used to group similar blobs. compression is the zlib level; blobs that
+    are already compressed are stored at level 0. The pack, its index and
+    the pack directory are synced before returning, so the loose copies can
+    be deleted safely. Returns the hex checksum naming the pack.
+    """
+    entries = []
+    for fmt, data, name in objects:
+        # The delta index hashes slices, which needs real bytes
+        data = bytes(data)
+        header = fmt + b" " + str(len(data)).encode() + b"\x00"
+        entries.append({
+            "sha": hashlib.sha1(header + data).digest(),
+            "type": TYPE_NUMBERS[fmt],
+            "name": name or "",
+            "data": data,
+        })
+
+    os.makedirs(pack_dir, exist_ok=True)
+    fd, tmp_pack = tempfile.mkstemp(prefix="tmp_pack_", dir=pack_dir)
+    checksum = hashlib.sha1()
+    index = []
+    offsets = {}
+    try:
+        with os.fdopen(fd, "wb") as f:
+            def emit(chunk):
+                f.write(chunk)
+                checksum.update(chunk)
+
+            emit(b"PACK" + struct.pack(">II", 2, len(entries)))
+            offset = 12
+            for obj, base, delta in _choose_deltas(entries, window, depth):
+                if base is None:
+                    level = compression
+                    if obj["type"] == TYPE_NUMBERS[b"blob"]:
+                        level = blob_compression_level(level, obj["data"][:TRIAL_SAMPLE_SIZE], len(obj["data"]))
+                    raw = _entry_header(obj["type"], len(obj["data"]))
+                    raw += zlib.compress(obj["data"], level)
+                else:
+                    raw = _entry_header(OBJ_OFS_DELTA, len(delta))
+                    raw += _ofs_encode(offset - offsets[base["sha"]])
+                    raw += zlib.compress(delta, compression)
+                emit(raw)
+                offsets[obj["sha"]] = offset
+                index.append((obj["sha"], zlib.crc32(raw), offset))
+                offset += len(raw)
+            pack_sha = checksum.digest()
+            f.write(pack_sha)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # The pack goes into place first: readers only use packs with an idx
+        name = "pack-" + pack_sha.hex()
+        os.chmod(tmp_pack, 0o444)
+        os.replace(tmp_pack, os.path.join(pack_dir, name + ".pack"))
+        _index_write(os.path.join(pack_dir, name + ".idx"), index, pack_sha)
+    except BaseException:
+        if os.path.exists(tmp_pack):
+            os.unlink(tmp_pack)
+        raise
+    # Both files must be on disk before gc may delete the loose copies
+    fsync_dir(pack_dir)
+    return pack_sha.hex()
+
+
+def _index_write(path, index, pack_sha):
+    index.sort()
+    fanout = [0] * 256
+    for sha, _, _ in index:
+        fanout[sha[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    parts = [IDX_MAGIC, struct.pack(">I", 2), struct.pack(">256I", *fanout)]
+    parts.extend(sha for sha, _, _ in index)
+    parts.extend(struct.pack(">I", crc) for _, crc, _ in index)
+    large = []
+    for _, _, offset in index:
+        if offset < 0x80000000:
+            parts.append(struct.pack(">I", offset))
+        else:
+            parts.append(struct.pack(">I", 0x80000000 | len(large)))
+            large.append(offset)
+    parts.extend(struct.pack(">Q", offset) for offset in large)
+    parts.append(pack_sha)
+
+    data = b"".join(parts)
+    fd, tmp_idx = tempfile.mkstemp(prefix="tmp_idx_", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data + hashlib.sha1(data).digest())
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp_idx, 0o444)
+    os.replace(tmp_idx, path)
+
+
+def repo_packs(repo):
+    """Return the packfiles of a repository, opening them on first use
+
+    The list is only published once complete, so a thread that races the
+    first call never sees some packs missing.
+    """
+    if repo.packs is None:
+        packs = []
+        pack_dir = repo.repo_path("objects", "pack")
+        if os.path.isdir(pack_dir):
+            for name in sorted(os.listdir(pack_dir)):
+                if name.endswith(".pack") and os.path.exists(
+                    os.path.join(pack_dir, name[:-len(".pack")] + ".idx")
+                ):
+                    packs.append(PackFile(os.path.join(pack_dir, name)))
+        repo.packs = packs
+    return repo.packs
+
+
+def _pack_find(repo, sha):
+    """Locate sha in the repository packs, returning (pack, offset) or None"""
+    if len(sha) != 40:
+        return None
+    try:
+        binsha = bytes.fromhex(sha)
+    except ValueError:
+        return None
+
+    for pack in repo_packs(repo):
+        offset = pack.index.find(binsha)
+        if offset is not None:
+            return pack, offset
+    return None
+
+
+def pack_has(repo, sha):
+    """True if any pack in the repository holds sha"""
+    return _pack_find(repo, sha) is not None
+
+
+def _resolve_ref(repo):
+    def resolve(base_sha):
+        from base import object_read_raw
+        return object_read_raw(repo, base_sha.hex())
+    return resolve
+
+
+def pack_read(repo, sha):
+    """Read an object from any pack in the repository, or return None"""
+    found = _pack_find(repo, sha)
+    if found is None:
+        return None
+    pack, offset = found
+    return pack.read_at(offset, _resolve_ref(repo))
+
+
+def pack_header(repo, sha):
+    """Return (fmt, size) of a packed object, or None"""
+    found = _pack_find(repo, sha)
+    if found is None:
+        return None
+
+    def resolve_header(base_sha):
+        from base import object_header
+        return object_header(repo, base_sha.hex())
+
+    pack, offset = found
+    return pack.header_at(offset, resolve_header)
+
+
+def pack_stream(repo, sha, chunk_size):
+    """Stream a packed object like base.object_stream, or return None"""
+    found = _pack_find(repo, sha)
+    if found is None:
+        return None
+    pack, offset = found
+    return pack.stream_at(offset, chunk_size, _resolve_ref(repo))
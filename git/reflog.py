@@ -0,0 +1,148 @@
+import os
+import time
+from lockfile import commit_lock_file, lock_file, rollback_lock_file
+
+
+# Reflogs are read from the end in blocks of this size
+REFLOG_BLOCK_SIZE = 64 * 1024
+
+# Refs whose updates are always logged; others only once their log exists
+LOGGED_PREFIXES = ("refs/heads/", "refs/remotes/", "refs/notes/")
+
+
+def reflog_path(repo, name):
+    return repo.repo_path("logs", name)
+
+
+def reflog_ident():
+    """The "Name <email>" recorded with each reflog entry"""
+    name = os.environ.get("GIT_COMMITTER_NAME", os.environ.get("GIT_AUTHOR_NAME", "Anonymous"))
+    email = os.environ.get("GIT_COMMITTER_EMAIL", os.environ.get("GIT_AUTHOR_EMAIL", "anonymous@example.com"))
+    return f"{name} <{email}>"
+
+
+def reflog_format(old_sha, new_sha, ident, message, timestamp=None):
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    # Messages are single lines; git squashes newlines the same way
+    message = " ".join(message.split())
+    return f"{old_sha} {new_sha} {ident} {timestamp} {time.strftime('%z')}\t{message}\n"
+
+
+def reflog_append(repo, name, old_sha, new_sha, message, force=False):
+    """Append one entry to name's reflog
+
+    The entry is a single O_APPEND write, so concurrent appends never
+    interleave and the file is neither read nor synced. Only HEAD and
+    branches are logged unless force is set or the log already exists.
+    """
+    path = reflog_path(repo, name)
+    line = reflog_format(old_sha, new_sha, reflog_ident(), message).encode()
+    flags = os.O_WRONLY | os.O_APPEND
+    if force or name == "HEAD" or name.startswith(LOGGED_PREFIXES):
+        flags |= os.O_CREAT
+    try:
+        fd = os.open(path, flags, 0o644)
+    except FileNotFoundError:
+        if not flags & os.O_CREAT:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, flags, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def reflog_list(repo):
+    """Names of the refs that have a reflog, sorted"""
+    logs_dir = repo.repo_path("logs")
+    names = []
+    for root, _, filenames in os.walk(logs_dir):
+        for filename in filenames:
+            if not filename.endswith(".lock"):
+                names.append(os.path.relpath(os.path.join(root, filename), logs_dir).replace(os.sep, "/"))
+    return sorted(names)
+
+
+def reflog_delete(repo, name):
+    try:
+        os.unlink(reflog_path(repo, name))
+    except FileNotFoundError:
+        pass
+
+
+def reflog_parse(line):
+    """Split a reflog line into (old, new, ident, timestamp, tz, message)"""
+    header, _, message = line.partition("\t")
+    old_sha, new_sha, rest = header.split(" ", 2)
+    ident, _, date = rest.rpartition("> ")
+    timestamp, _, tz = date.partition(" ")
+    return old_sha, new_sha, ident + ">", int(timestamp), tz, message.rstrip("\n")
+
+
+def _lines_reversed(f, block_size=REFLOG_BLOCK_SIZE):
+    """Yield the lines of a binary file last first, reading one block at a time"""
+    pos = f.seek(0, os.SEEK_END)
+    tail = b""
+    while pos > 0:
+        step = min(block_size, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + tail).split(b"\n")
+        # The first piece may be the end of a line that starts further back
+        tail = lines.pop(0)
+        for line in reversed(lines):
+            if line:
+                yield line
+    if tail:
+        yield tail
+
+
+def reflog_entries(repo, name):
+    """Yield parsed entries of name's reflog, newest first
+
+    Only as much of the file as the caller consumes is read.
+    """
+    try:
+        f = open(reflog_path(repo, name), "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in _lines_reversed(f):
+            yield reflog_parse(line.decode("utf-8", "replace"))
+
+
+def reflog_expire(repo, name, cutoff):
+    """Drop entries older than the cutoff timestamp, returning how many went
+
+    The ref is locked meanwhile so no update appends to the log while it is
+    rewritten, and the log is streamed into its replacement rather than
+    loaded. A log with nothing to expire is left untouched.
+    """
+    path = reflog_path(repo, name)
+    if not os.path.exists(path):
+        return 0
+
+    ref_path = repo.repo_path(name)
+    ref_lock = lock_file(ref_path)
+    try:
+        log_lock = lock_file(path)
+        expired = 0
+        try:
+            with open(path, "rb") as f, os.fdopen(log_lock, "wb", closefd=False) as out:
+                for line in f:
+                    if reflog_parse(line.decode("utf-8", "replace"))[3] < cutoff:
+                        expired += 1
+                    else:
+                        out.write(line)
+            os.fsync(log_lock)
+        except BaseException:
+            rollback_lock_file(log_lock, path)
+            raise
+        if expired:
+            commit_lock_file(log_lock, path)
+        else:
+            rollback_lock_file(log_lock, path)
+    finally:
+        rollback_lock_file(ref_lock, ref_path)
+    return expired
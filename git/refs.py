@@ -0,0 +1,216 @@
+import os
+from lockfile import commit_lock_file, fsync_dir, lock_file, rollback_lock_file, write_lock_file
+from reflog import reflog_append, reflog_delete
+
+
+PACKED_REFS_HEADER = "# pack-refs with: sorted \n"
+
+# Expected old value meaning "the ref must not exist yet"
+NULL_SHA = "0" * 40
+
+
+def packed_refs_parse(text):
+    """Parse packed-refs content into {ref name: SHA}
+
+    Peeled lines ("^SHA", the commit an annotated tag points at) are
+    skipped, as are comments.
+    """
+    refs = {}
+    for line in text.splitlines():
+        if not line or line[0] in "#^":
+            continue
+        sha, _, name = line.partition(" ")
+        refs[name] = sha
+    return refs
+
+
+def packed_refs_serialize(refs):
+    lines = [PACKED_REFS_HEADER]
+    for name in sorted(refs):
+        lines.append(f"{refs[name]} {name}\n")
+    return "".join(lines)
+
+
+class RefTransaction:
+    """A batch of ref updates applied all together or not at all
+
+    Every ref is locked with a "<ref>.lock" file before anything changes,
+    so concurrent writers fail fast instead of interleaving. An update can
+    name the value it expects the ref to hold now (NULL_SHA for "must not
+    exist"); if any ref moved in the meantime, nothing is written.
+
+    Each update is recorded in the ref's reflog, and in HEAD's when HEAD
+    points at the ref, while the ref is still locked.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.updates = {}
+
+    def update(self, name, new_value, old_value=None, message=""):
+        """Set name to new_value, a SHA or "ref: <target>"
+
+        old_value, when given, is the value the ref must hold at commit time;
+        message is the reason recorded in the reflog.
+        """
+        if name in self.updates:
+            raise Exception(f"Multiple updates for ref '{name}' not allowed")
+        self.updates[name] = (new_value, old_value, message)
+
+    def delete(self, name, old_value=None):
+        self.update(name, None, old_value)
+
+    def commit(self):
+        """Lock, check and write every update, raising if any ref cannot be"""
+        repo = self.repo
+        locks = []
+        try:
+            # A fixed order keeps two overlapping transactions from each
+            # holding part of the other's locks
+            for name in sorted(self.updates):
+                path = repo.repo_path(name)
+                locks.append((lock_file(path), path))
+            deletes = [name for name, (new, _, _) in self.updates.items() if new is None]
+            if deletes:
+                packed_path = repo.repo_path("packed-refs")
+                locks.append((lock_file(packed_path), packed_path))
+
+            # Read values only once every lock is held
+            repo.refs_invalidate()
+            current_values = {}
+            for name, (new, old, _) in sorted(self.updates.items()):
+                current = current_values[name] = repo.ref_read(name)
+                if old is not None and (current or NULL_SHA) != old:
+                    raise Exception(
+                        f"Cannot lock ref '{name}': is at {current or NULL_SHA} but expected {old}"
+                    )
+                if new is None and current is None:
+                    raise Exception(f"Cannot delete ref '{name}': it does not exist")
+
+            for (fd, path), name in zip(locks, sorted(self.updates)):
+                new = self.updates[name][0]
+                if new is not None:
+                    write_lock_file(fd, (new + "\n").encode())
+            if deletes:
+                packed = {
+                    name: sha for name, sha in repo.packed_refs().items()
+                    if name not in self.updates or self.updates[name][0] is not None
+                }
+                write_lock_file(locks[-1][0], packed_refs_serialize(packed).encode())
+            self._log(current_values)
+        except BaseException:
+            for fd, path in locks:
+                rollback_lock_file(fd, path)
+            repo.refs_invalidate()
+            raise
+
+        # Packed entries go before the loose files, so a deleted ref never
+        # falls back to an older packed value
+        directories = set()
+        if deletes:
+            fd, path = locks.pop()
+            commit_lock_file(fd, path)
+            directories.add(os.path.dirname(path))
+        for (fd, path), name in zip(locks, sorted(self.updates)):
+            if self.updates[name][0] is None:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                rollback_lock_file(fd, path)
+                remove_empty_dirs(repo, path)
+                reflog_delete(repo, name)
+            else:
+                commit_lock_file(fd, path)
+                directories.add(os.path.dirname(path))
+        for directory in directories:
+            fsync_dir(directory)
+        repo.refs_invalidate()
+
+    def _log(self, current_values):
+        """Append reflog entries for every update that sets a value"""
+        head = self.repo.ref_read("HEAD")
+        head_target = head[5:] if head and head.startswith("ref: ") else None
+        for name, (new, _, message) in sorted(self.updates.items()):
+            if new is None:
+                continue
+            old_sha = self._sha(current_values[name])
+            new_sha = self._sha(new)
+            reflog_append(self.repo, name, old_sha, new_sha, message)
+            if name == head_target and "HEAD" not in self.updates:
+                reflog_append(self.repo, "HEAD", old_sha, new_sha, message)
+
+    def _sha(self, value):
+        """The SHA a ref value stands for, following symbolic refs"""
+        if value is None:
+            return NULL_SHA
+        if value.startswith("ref: "):
+            sha = self.repo.ref_resolve(value[5:])
+            return NULL_SHA if sha == value[5:] else sha
+        return value
+
+
+def pack_refs(repo, all_refs=False, prune=True):
+    """Move loose refs into packed-refs, returning how many were packed
+
+    Like git, only tags and refs that are already packed are included
+    unless all_refs is set; symbolic refs always stay loose. With prune the
+    loose files are removed afterwards, unless they changed in between.
+
+    packed-refs is locked before anything is read, so a transaction that
+    deletes a ref cannot commit in between and see its ref written back.
+    """
+    packed_path = repo.repo_path("packed-refs")
+    fd = lock_file(packed_path)
+    try:
+        repo.refs_invalidate()
+        packed = dict(repo.packed_refs())
+        moved = {}
+        for name in repo.loose_refs():
+            if not (all_refs or name.startswith("refs/tags/") or name in packed):
+                continue
+            # A locked ref is mid-update, possibly a delete whose packed
+            # entry is already gone; leave it to that transaction
+            if os.path.exists(repo.repo_path(name) + ".lock"):
+                continue
+            value = repo.ref_read(name)
+            if value is None or value.startswith("ref: "):
+                continue
+            packed[name] = moved[name] = value
+        write_lock_file(fd, packed_refs_serialize(packed).encode())
+    except BaseException:
+        rollback_lock_file(fd, packed_path)
+        raise
+    commit_lock_file(fd, packed_path)
+    repo.refs_invalidate()
+
+    if prune:
+        for name, value in moved.items():
+            path = repo.repo_path(name)
+            try:
+                fd = lock_file(path)
+            except Exception:
+                # Being updated right now; the loose value wins anyway
+                continue
+            try:
+                with open(path) as f:
+                    if f.read().strip() == value:
+                        os.unlink(path)
+            except FileNotFoundError:
+                pass
+            rollback_lock_file(fd, path)
+            remove_empty_dirs(repo, path)
+        repo.refs_invalidate()
+    return len(moved)
+
+
+def remove_empty_dirs(repo, path):
+    """Remove the directories a deleted ref leaves empty, keeping refs/heads etc."""
+    refs_dir = repo.repo_path("refs")
+    parent = os.path.dirname(path)
+    while os.path.dirname(parent) != refs_dir and parent.startswith(refs_dir + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
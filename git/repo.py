@@ -1,5 +1,8 @@
 import os
 import configparser
+from cache import ObjectCache, DEFAULT_CACHE_SIZE
+from compress import config_compression_level
+from refs import RefTransaction, packed_refs_parse
 
 
 class GitRepository:
@@ -13,20 +16,61 @@ class GitRepository:
             raise Exception(f"Not a Git repository {path}")
 
         self.conf = configparser.ConfigParser()
+
+        # Packfiles are opened lazily by pack.repo_packs
+        self.packs = None
+
+        # Loaded lazily by commit_graph.repo_commit_graph (False if absent)
+        self.commit_graph = None
+
+        # Directories awaiting an fsync inside base.object_write_batch
+        self.object_sync_dirs = None
+
+        # Ref table, loaded by _refs_load and reloaded when refs change
+        self._loose_refs = set()
+        self._packed_refs = {}
+        self._refs_stamp = None
         
-        # Only attempt to load config file if we're not forcing
+        # The config is read whenever it exists; only a forced open (used
+        # by init and the commands) tolerates it missing
+        config_file = self.repo_file("config")
+        if config_file and os.path.exists(config_file):
+            self.conf.read([config_file])
+        elif not force:
+            raise Exception("Configuration file missing")
+
         if not force:
-            config_file = self.repo_file("config")
-            
-            if config_file and os.path.exists(config_file):
-                self.conf.read([config_file])
-            else:
-                raise Exception("Configuration file missing")
-                
             vers = int(self.conf.get("core", "repositoryformatversion"))
             if vers != 0:
                 raise Exception(f"Unsupported repositoryformatversion {vers}")
 
+        # Parsed objects shared by every object_read on this repository
+        self.object_cache = ObjectCache(
+            self.conf.getint("core", "objectcachesize", fallback=DEFAULT_CACHE_SIZE)
+        )
+
+        # Whether the executable bit in the worktree can be trusted
+        self.filemode = self.conf.getboolean("core", "filemode", fallback=True)
+
+        # Threads used to hash and compress blobs
+        self.write_workers = config_workers(self.conf, "core", "writeworkers")
+
+        # zlib levels, as in git: core.compression applies everywhere, and
+        # core.looseCompression (default 1, fastest) and pack.compression
+        # override it for loose objects and packs
+        compression = config_compression_level(self.conf, "core", "compression", None)
+        self.loose_compression = config_compression_level(
+            self.conf, "core", "loosecompression", 1 if compression is None else compression
+        )
+        self.pack_compression = config_compression_level(
+            self.conf, "pack", "compression", -1 if compression is None else compression
+        )
+
+        # Threads used to write files during checkout and to lstat the
+        # worktree in status
+        self.checkout_workers = config_workers(self.conf, "checkout", "workers")
+        self.status_workers = config_workers(self.conf, "status", "workers")
+
     def repo_path(self, *path):
         return os.path.join(self.gitdir, *path)
 
@@ -45,69 +89,156 @@ class GitRepository:
             raise Exception(f"Not a directory: {path}")
 
         if mkdir:
-            os.makedirs(path)
+            # Concurrent writers may race to create the same directory
+            os.makedirs(path, exist_ok=True)
             return path
         return None
 
+    def _refs_load(self):
+        """Load the ref table, unless nothing changed since the last load
+
+        The table holds every packed ref with its value and the names of the
+        loose refs. Loose refs are added and removed by renaming files, which
+        changes their directory's mtime, so statting packed-refs and the
+        directories under refs/ is enough to tell whether it is stale.
+        """
+        if self._refs_stamp is not None and self._refs_stamp == self._refs_current_stamp():
+            return
+
+        stamp = {}
+        packed_path = self.repo_path("packed-refs")
+        try:
+            stamp[packed_path] = _stat_key(os.stat(packed_path))
+            with open(packed_path) as f:
+                packed = packed_refs_parse(f.read())
+        except FileNotFoundError:
+            stamp[packed_path] = None
+            packed = {}
+
+        loose = set()
+        pending = ["refs"]
+        while pending:
+            rel_dir = pending.pop()
+            dir_path = self.repo_path(rel_dir)
+            try:
+                # Stat before listing, so a change made meanwhile is not missed
+                stamp[dir_path] = _stat_key(os.stat(dir_path))
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        name = f"{rel_dir}/{entry.name}"
+                        if entry.is_dir():
+                            pending.append(name)
+                        elif not entry.name.endswith(".lock"):
+                            loose.add(name)
+            except FileNotFoundError:
+                stamp[dir_path] = None
+
+        self._loose_refs = loose
+        self._packed_refs = packed
+        self._refs_stamp = stamp
+
+    def _refs_current_stamp(self):
+        stamp = {}
+        for path in self._refs_stamp:
+            try:
+                stamp[path] = _stat_key(os.stat(path))
+            except FileNotFoundError:
+                stamp[path] = None
+        return stamp
+
+    def refs_invalidate(self):
+        """Forget the ref table so the next lookup reloads it"""
+        self._refs_stamp = None
+
+    def loose_refs(self):
+        """Names of the refs stored as files under refs/"""
+        self._refs_load()
+        return self._loose_refs
+
+    def packed_refs(self):
+        """{name: SHA} for the refs stored in packed-refs"""
+        self._refs_load()
+        return self._packed_refs
+
+    def ref_read(self, name):
+        """Return the stored value of exactly this ref, or None if it is missing
+
+        Loose refs take precedence over packed ones. The value is a SHA, or
+        "ref: <target>" for a symbolic ref.
+        """
+        if name.startswith("refs/"):
+            self._refs_load()
+            if name not in self._loose_refs:
+                return self._packed_refs.get(name)
+        path = self.repo_path(name)
+        try:
+            with open(path, "r") as f:
+                return f.read().strip()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            # Deleted since the table was loaded
+            return self._packed_refs.get(name) if name.startswith("refs/") else None
+
     def ref_resolve(self, ref):
         """Resolve a symbolic reference to a SHA hash"""
-        path = self.repo_file(ref)
-        
-        # Check if it's a direct reference
-        if not path or not os.path.exists(path):
-            # It could be a file in refs/
-            path = self.repo_file("refs", ref)
-            if not path or not os.path.exists(path):
-                # It could be a more specific reference
-                for prefix in ["refs/heads/", "refs/tags/", "refs/"]:
-                    path = self.repo_file(prefix + ref)
-                    if path and os.path.exists(path):
-                        break
-                    path = None
-                
-        if not path or not os.path.exists(path):
+        # Same order as before packed-refs: the name itself, then under refs/
+        for name in [ref, "refs/" + ref, "refs/heads/" + ref, "refs/tags/" + ref]:
+            content = self.ref_read(name)
+            if content is not None:
+                break
+        else:
             # If nothing worked, assume ref is a direct SHA
             return ref
-            
-        # Read the file
-        with open(path, "r") as f:
-            content = f.read().strip()
-            
+
         # Check if it's a symbolic reference
         if content.startswith("ref: "):
             return self.ref_resolve(content[5:])
-            
+
         # It's a direct reference to a hash
         return content
-        
+
     def ref_list(self, path=None):
-        """List all references in the repository"""
-        if not path:
-            path = self.repo_dir("refs")
-        ret = []
-        
-        # Walk through all files in refs/
-        for root, _, filenames in os.walk(path):
-            for filename in filenames:
-                filepath = os.path.join(root, filename)
-                # Get path relative to .git directory
-                ref = os.path.relpath(filepath, self.repo_dir())
-                ret.append(ref)
-                
-        return ret
-        
-    def ref_create(self, ref_name, ref_value):
-        """Create a new reference"""
+        """List all references in the repository, loose and packed, sorted
+
+        path limits the listing to refs below a directory such as refs/heads.
+        """
+        self._refs_load()
+        refs = self._loose_refs.union(self._packed_refs)
+        if path:
+            if os.path.isabs(path):
+                path = os.path.relpath(path, self.gitdir)
+            prefix = path.replace(os.sep, "/").rstrip("/") + "/"
+            refs = [ref for ref in refs if ref.startswith(prefix)]
+        return sorted(refs)
+
+    def ref_create(self, ref_name, ref_value, message=""):
+        """Create a new reference, logging message in its reflog"""
         # Ensure it starts with refs/
         if not ref_name.startswith("refs/"):
             ref_name = f"refs/heads/{ref_name}"
-            
-        path = self.repo_file(ref_name, mkdir=True)
-        
-        with open(path, "w") as f:
-            f.write(ref_value + "\n")
-            
-        return path
+
+        transaction = RefTransaction(self)
+        transaction.update(ref_name, ref_value, message=message)
+        transaction.commit()
+
+        return self.repo_path(ref_name)
+
+    def ref_delete(self, name, old_value=None):
+        """Delete a ref, both its loose file and any packed-refs entry"""
+        transaction = RefTransaction(self)
+        transaction.delete(name, old_value)
+        transaction.commit()
+
+
+def config_workers(conf, section, key):
+    """Read a thread count from the config: 1 by default, 0 for one per CPU"""
+    workers = conf.getint(section, key, fallback=1)
+    if workers < 1:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _stat_key(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
 
 
 def repo_create(path):
@@ -0,0 +1,167 @@
+import heapq
+import itertools
+import re
+import time
+from datetime import datetime
+from commit_graph import commit_info
+
+
+# Units accepted by relative dates such as "2 weeks ago"
+DATE_UNITS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+    "month": 30 * 86400,
+    "year": 365 * 86400,
+}
+RELATIVE_DATE = re.compile(r"(\d+)\s*(second|minute|hour|day|week|month|year)s?\s+ago")
+
+
+def parse_date(text, now=None):
+    """Parse a --since/--until value into a Unix timestamp
+
+    Accepts a raw timestamp, an ISO 8601 date or datetime, or a relative
+    date like "3 days ago".
+    """
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+
+    match = RELATIVE_DATE.fullmatch(text.replace(".", " "))
+    if match:
+        now = time.time() if now is None else now
+        return int(now - int(match.group(1)) * DATE_UNITS[match.group(2)])
+
+    try:
+        return int(datetime.fromisoformat(text).timestamp())
+    except ValueError:
+        raise Exception(f"Unrecognised date: {text}")
+
+
+def parse_revisions(r, revisions):
+    """Split revision arguments into (include, exclude) lists of SHAs
+
+    Supports plain revisions, "^rev" exclusions and "A..B" ranges, where an
+    empty side stands for HEAD.
+    """
+    include = []
+    exclude = []
+    for rev in revisions or ["HEAD"]:
+        if ".." in rev:
+            left, right = rev.split("..", 1)
+            exclude.append(r.ref_resolve(left or "HEAD"))
+            include.append(r.ref_resolve(right or "HEAD"))
+        elif rev.startswith("^"):
+            exclude.append(r.ref_resolve(rev[1:]))
+        else:
+            include.append(r.ref_resolve(rev))
+    return include, exclude
+
+
+class RevWalk:
+    """Walk commit history newest first, following every parent
+
+    Commits are kept in a heap ordered by committer date, each commit is
+    visited once, and parents come from the commit-graph when there is one.
+    Without exclusions the walk is lazy: taking the first n commits only
+    reads about n commits.
+    """
+
+    def __init__(self, repo, include, exclude=(), first_parent=False,
+                 since=None, until=None):
+        self.repo = repo
+        self.first_parent = first_parent
+        self.since = since
+        self.until = until
+
+        self.queue = []
+        self.counter = 0
+        self.seen = set()
+        self.queued = set()
+        self.uninteresting = set()
+        # Queued commits that are not (yet) known to be excluded
+        self.interesting = 0
+        self.info = {}
+
+        for sha in exclude:
+            self.uninteresting.add(sha)
+            self._push(sha)
+        for sha in include:
+            self._push(sha)
+
+    def _push(self, sha):
+        if sha in self.seen:
+            return
+        self.seen.add(sha)
+        self.queued.add(sha)
+        if sha not in self.uninteresting:
+            self.interesting += 1
+        info = commit_info(self.repo, sha)
+        self.info[sha] = info
+        # The counter keeps equal dates in insertion order
+        heapq.heappush(self.queue, (-info[1], self.counter, sha))
+        self.counter += 1
+
+    def _pop(self):
+        """Take the newest queued commit and queue its parents"""
+        _, _, sha = heapq.heappop(self.queue)
+        self.queued.discard(sha)
+        parents = self.info[sha][0]
+
+        if sha in self.uninteresting:
+            # Everything reachable from an excluded commit is excluded too,
+            # through every parent even with first_parent
+            for parent in parents:
+                if parent in self.queued and parent not in self.uninteresting:
+                    self.interesting -= 1
+                self.uninteresting.add(parent)
+        else:
+            self.interesting -= 1
+            if self.first_parent:
+                parents = parents[:1]
+        for parent in parents:
+            self._push(parent)
+        return sha
+
+    def _limited(self):
+        """Resolve exclusions up front, as git does for ranges
+
+        Walks until only excluded commits are left in the queue, then drops
+        anything that turned out to be reachable from an exclusion.
+        """
+        found = []
+        while self.interesting:
+            found.append(self._pop())
+        return [sha for sha in found if sha not in self.uninteresting]
+
+    def __iter__(self):
+        if self.uninteresting:
+            candidates = iter(self._limited())
+        else:
+            candidates = iter(lambda: self._pop() if self.queue else None, None)
+
+        for sha in candidates:
+            date = self.info[sha][1]
+            if self.since is not None and date < self.since:
+                # The queue is date ordered, so everything left is older
+                return
+            if self.until is not None and date > self.until:
+                continue
+            yield sha
+
+    def parents(self, sha):
+        """Parents of a commit the walk has already produced"""
+        return self.info[sha][0]
+
+
+def rev_walk(repo, revisions=None, max_count=None, **options):
+    """Return an iterator of commit SHAs for revision arguments, newest first
+
+    Revisions are resolved before this returns, so bad arguments raise here
+    rather than partway through the output.
+    """
+    include, exclude = parse_revisions(repo, revisions)
+    walk = RevWalk(repo, include, exclude, **options)
+    return itertools.islice(walk, max_count)
@@ -0,0 +1,178 @@
+import os
+import stat
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from base import object_read, object_write_path
+from worktree import file_mode
+
+
+def _list_dir(worktree, rel_dir):
+    """lstat the files of one directory, returning (files, subdirectories)
+
+    os.scandir reports entry types from the directory listing itself, so
+    each file costs a single lstat and directories cost none.
+    """
+    files = []
+    dirs = []
+    with os.scandir(os.path.join(worktree, rel_dir)) as it:
+        for entry in it:
+            if entry.name == ".git":
+                continue
+            rel_path = rel_dir + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(rel_path + "/")
+                continue
+            st = entry.stat(follow_symlinks=False)
+            if stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                files.append((rel_path, st))
+    return files, dirs
+
+
+def scan_worktree(repo):
+    """Return {path: lstat result} for every file and symlink in the worktree
+
+    Directories are listed on status.workers threads; each finished listing
+    queues its subdirectories, so deep and wide trees both keep the pool
+    busy.
+    """
+    worktree = repo.worktree
+    files = {}
+    if repo.status_workers <= 1:
+        pending = [""]
+        while pending:
+            found, dirs = _list_dir(worktree, pending.pop())
+            files.update(found)
+            pending.extend(dirs)
+        return files
+
+    with ThreadPoolExecutor(max_workers=repo.status_workers) as pool:
+        pending = {pool.submit(_list_dir, worktree, "")}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, dirs = future.result()
+                files.update(found)
+                pending.update(pool.submit(_list_dir, worktree, d) for d in dirs)
+    return files
+
+
+def _head_files(repo, tree_sha, node, prefix, files, same):
+    """Collect HEAD's files, skipping directories the cache-tree vouches for
+
+    A valid cache-tree entry with the same SHA as HEAD's subtree means the
+    index holds exactly that subtree, so it is recorded in same instead of
+    being read. files maps each path to its (mode, sha).
+    """
+    if node is not None and node.entry_count >= 0 and node.sha == tree_sha:
+        same.add(prefix)
+        return
+    for mode, name, sha in object_read(repo, tree_sha):
+        if mode.lstrip("0") == "40000":
+            child = node.children.get(name) if node is not None else None
+            _head_files(repo, sha, child, prefix + name + "/", files, same)
+        else:
+            files[prefix + name] = (int(mode, 8), sha)
+
+
+def _in_same(path, same):
+    if not same:
+        return False
+    if "" in same:
+        return True
+    pos = path.find("/")
+    while pos != -1:
+        if path[:pos + 1] in same:
+            return True
+        pos = path.find("/", pos + 1)
+    return False
+
+
+def staged_changes(repo, index, head_tree):
+    """Return sorted (status, path) pairs for the index against HEAD's tree"""
+    head = {}
+    same = set()
+    if head_tree:
+        _head_files(repo, head_tree, index.cache_tree, "", head, same)
+
+    changes = []
+    for path, entry in index.entries.items():
+        if _in_same(path, same):
+            continue
+        mode_sha = head.get(path)
+        if mode_sha is None:
+            changes.append(("A", path))
+        elif mode_sha != (entry.mode, entry.sha):
+            changes.append(("M", path))
+    for path in head:
+        if path not in index.entries:
+            changes.append(("D", path))
+    return sorted(changes, key=lambda change: change[1])
+
+
+def unstaged_changes(repo, index, files):
+    """Return sorted (status, path) pairs for the worktree against the index
+
+    Stat data decides almost every entry. Files are only hashed when their
+    size is unchanged but other stat fields differ, or when the entry is
+    racily clean; entries found unchanged that way get fresh stat data so
+    the next run does not hash them again.
+    """
+    changes = []
+    for path, entry in index.entries.items():
+        st = files.get(path)
+        if st is None:
+            changes.append(("D", path))
+            continue
+        # A mode change also changes ctime, so check it before the stat data
+        if file_mode(repo, st, entry) != entry.mode:
+            changes.append(("M", path))
+            continue
+        if entry.stat_matches(st) and not index.is_racy(entry):
+            continue
+        if entry.size != st.st_size & 0xFFFFFFFF:
+            changes.append(("M", path))
+            continue
+
+        sha = object_write_path(repo, os.path.join(repo.worktree, path), st, actually_write=False)
+        if sha == entry.sha:
+            index.update(path, sha, st, mode=entry.mode)
+        else:
+            changes.append(("M", path))
+    return sorted(changes, key=lambda change: change[1])
+
+
+def untracked_files(index, files):
+    """Sorted untracked paths, collapsing wholly untracked directories to "dir/" """
+    tracked_dirs = set()
+    for path in index.entries:
+        pos = path.find("/")
+        while pos != -1:
+            tracked_dirs.add(path[:pos + 1])
+            pos = path.find("/", pos + 1)
+
+    untracked = set()
+    for path in files:
+        if path in index.entries:
+            continue
+        # Report the outermost directory that holds nothing tracked
+        shown = path
+        pos = path.find("/")
+        while pos != -1:
+            if path[:pos + 1] not in tracked_dirs:
+                shown = path[:pos + 1]
+                break
+            pos = path.find("/", pos + 1)
+        untracked.add(shown)
+    return sorted(untracked)
+
+
+def worktree_status(repo, index, head_tree):
+    """Return (staged, unstaged, untracked) for a repository
+
+    staged and unstaged are lists of (status, path) with status A, M or D.
+    """
+    files = scan_worktree(repo)
+    return (
+        staged_changes(repo, index, head_tree),
+        unstaged_changes(repo, index, files),
+        untracked_files(index, files),
+    )
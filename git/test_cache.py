@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import shutil
+import tempfile
+import repo
+from base import object_read, object_write
+from cache import ObjectCache
+from object import GitBlob
+
+
+def test_cache_eviction():
+    """The cache evicts least recently used objects to stay within its byte bound"""
+    cache = ObjectCache(limit=150)
+    cache.put("a", "A", 100)
+    cache.put("b", "B", 100)
+    assert "a" not in cache and "b" in cache
+    assert cache.size == 100 and len(cache) == 1
+
+    # Objects larger than the whole cache are not kept at all
+    cache.put("huge", "H", 151)
+    assert "huge" not in cache and "b" in cache
+
+    cache = ObjectCache(limit=250)
+    cache.put("a", "A", 100)
+    cache.put("b", "B", 100)
+    assert cache.get("a") == "A"
+    cache.put("c", "C", 100)
+    assert "a" in cache and "b" not in cache and "c" in cache
+
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Replacing an entry does not count its old size twice
+    cache.put("c", "C2", 50)
+    assert cache.size == 150 and cache.get("c") == "C2"
+    print("✓ Object cache evicts by size in LRU order")
+
+
+def test_object_read_uses_cache():
+    """Repeated reads of one object are served from the repository cache"""
+    path = tempfile.mkdtemp(prefix="wyag-cache-")
+    try:
+        r = repo.repo_create(path)
+        sha = object_write(GitBlob(r, b"cached\n"))
+        r.object_cache.clear()
+
+        first = object_read(r, sha)
+        assert (r.object_cache.hits, r.object_cache.misses) == (0, 1)
+        assert object_read(r, sha) is first
+        assert (r.object_cache.hits, r.object_cache.misses) == (1, 1)
+        assert r.object_cache.size == len(b"cached\n")
+        print("✓ object_read goes through the object cache")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    test_cache_eviction()
+    test_object_read_uses_cache()
+    print("Test completed.")
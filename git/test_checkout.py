@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import repo
+from testutil import run_git
+from index import GitIndex, index_read, index_write
+from diff import change_status, diff_stat, diff_stat_format, tree_diff
+from worktree import checkout_tree
+from status import worktree_status
+from commands.status import format_short
+from commands.write_tree import write_tree
+
+
+def write(path, name, content):
+    full_path = os.path.join(path, name)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+        f.write(content)
+
+
+def make_branches():
+    """Create master and feature branches with real git
+
+    feature changes one file, deletes a directory, turns a directory into
+    a file and adds a new directory; everything else is shared.
+    """
+    path = tempfile.mkdtemp(prefix="wyag-checkout-")
+    run_git(path, "init", "-q", "-b", "master")
+    run_git(path, "config", "user.email", "test@example.com")
+    run_git(path, "config", "user.name", "Test User")
+
+    for i in range(20):
+        write(path, f"shared/file{i}.txt", f"shared {i}\n")
+    for name in ["src/main.py", "src/lib/util.py", "docs/readme"]:
+        write(path, name, f"{name}\n")
+    write(path, "run.sh", "#!/bin/sh\n")
+    os.chmod(os.path.join(path, "run.sh"), 0o755)
+    os.symlink("run.sh", os.path.join(path, "link"))
+    run_git(path, "add", "-A")
+    run_git(path, "commit", "-q", "-m", "master")
+
+    run_git(path, "checkout", "-q", "-b", "feature")
+    write(path, "src/main.py", "changed\n")
+    run_git(path, "rm", "-q", "-r", "docs", "src/lib")
+    write(path, "docs", "now a file\n")
+    write(path, "new/dir/file.txt", "new\n")
+    run_git(path, "add", "-A")
+    run_git(path, "commit", "-q", "-m", "feature")
+    run_git(path, "checkout", "-q", "master")
+    return path
+
+
+def tree_of(path, rev):
+    return run_git(path, "rev-parse", f"{rev}^{{tree}}").strip()
+
+
+def switch(r, path, rev):
+    """Check out rev with our engine, then point HEAD at it with git"""
+    index = index_read(r)
+    changed = checkout_tree(r, index, tree_of(path, "HEAD"), tree_of(path, rev))
+    index_write(r, index)
+    run_git(path, "symbolic-ref", "HEAD", f"refs/heads/{rev}")
+    return changed
+
+
+def test_checkout_touches_only_changes():
+    """Switching branches rewrites only differing files and leaves git clean"""
+    path = make_branches()
+    try:
+        r = repo.GitRepository(path)
+        shared = os.path.join(path, "shared", "file0.txt")
+        inode = os.stat(shared).st_ino
+
+        assert switch(r, path, "feature") == 5
+        assert run_git(path, "status", "--porcelain") == ""
+        assert os.path.isfile(os.path.join(path, "docs"))
+        assert not os.path.exists(os.path.join(path, "src", "lib"))
+        assert os.stat(shared).st_ino == inode
+
+        switch(r, path, "master")
+        assert run_git(path, "status", "--porcelain") == ""
+        assert os.readlink(os.path.join(path, "link")) == "run.sh"
+        assert os.access(os.path.join(path, "run.sh"), os.X_OK)
+        assert os.stat(shared).st_ino == inode
+        print("✓ checkout writes only changed files and git sees a clean tree")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_checkout_refuses_local_changes():
+    """Modified or untracked files in the way stop checkout before any write"""
+    path = make_branches()
+    try:
+        r = repo.GitRepository(path)
+        write(path, "src/main.py", "local edit\n")
+        try:
+            switch(r, path, "feature")
+            assert False, "checkout should have refused"
+        except Exception as e:
+            assert "src/main.py" in str(e)
+        assert open(os.path.join(path, "src", "main.py")).read() == "local edit\n"
+        assert os.path.isdir(os.path.join(path, "docs"))
+
+        run_git(path, "checkout", "-q", "--", "src/main.py")
+        write(path, "new/dir/file.txt", "untracked\n")
+        try:
+            switch(r, path, "feature")
+            assert False, "checkout should have refused"
+        except Exception as e:
+            assert "new/dir/file.txt" in str(e)
+
+        # An untracked file or symlink where a new directory must go
+        shutil.rmtree(os.path.join(path, "new"))
+        outside = tempfile.mkdtemp(prefix="wyag-outside-")
+        try:
+            for make in (lambda p: write(path, "new", "untracked\n"), lambda p: os.symlink(outside, p)):
+                make(os.path.join(path, "new"))
+                try:
+                    switch(r, path, "feature")
+                    assert False, "checkout should have refused"
+                except Exception as e:
+                    assert "\tnew\n" in str(e)
+                assert os.path.lexists(os.path.join(path, "new"))
+                assert os.listdir(outside) == []
+                os.unlink(os.path.join(path, "new"))
+        finally:
+            shutil.rmtree(outside)
+
+        # A held index lock stops the command before any file changes
+        open(r.repo_path("index.lock"), "w").close()
+        wyag = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wyag.py")
+        proc = subprocess.run([sys.executable, wyag, "checkout", "feature"], cwd=path,
+                              capture_output=True, text=True)
+        assert proc.stderr.startswith("Error: Unable to create"), proc.stderr
+        assert os.path.isdir(os.path.join(path, "docs"))
+        assert run_git(path, "symbolic-ref", "HEAD").strip() == "refs/heads/master"
+        print("✓ checkout refuses to overwrite local changes")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_parallel_checkout():
+    """A fresh checkout from packed objects on a worker pool matches git"""
+    path = make_branches()
+    try:
+        run_git(path, "gc", "-q")
+        for name in os.listdir(path):
+            if name != ".git":
+                full_path = os.path.join(path, name)
+                if os.path.isdir(full_path) and not os.path.islink(full_path):
+                    shutil.rmtree(full_path)
+                else:
+                    os.unlink(full_path)
+        os.unlink(os.path.join(path, ".git", "index"))
+
+        r = repo.GitRepository(path)
+        r.checkout_workers = 4
+        index = GitIndex()
+        checkout_tree(r, index, None, tree_of(path, "master"))
+        index_write(r, index)
+        assert run_git(path, "status", "--porcelain") == ""
+        assert os.readlink(os.path.join(path, "link")) == "run.sh"
+        print("✓ Parallel checkout of a packed tree matches git")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_checkout_commit_round_trip():
+    """A checked-out tree is written back with git's SHA, modes and symlinks included"""
+    path = make_branches()
+    try:
+        r = repo.GitRepository(path)
+        switch(r, path, "feature")
+        assert write_tree(r, path) == tree_of(path, "feature")
+
+        # With an empty index every file is hashed and its mode comes from lstat
+        os.unlink(r.repo_path("index"))
+        assert write_tree(r, path) == tree_of(path, "feature")
+
+        # A dangling symlink is still a file to commit
+        os.symlink("missing", os.path.join(path, "shared", "dangling"))
+        os.chmod(os.path.join(path, "src", "main.py"), 0o755)
+        run_git(path, "add", "-A")
+        assert write_tree(r, path) == run_git(path, "write-tree").strip()
+        run_git(path, "fsck", "--strict")
+        print("✓ checkout then write_tree reproduces git's trees")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_tree_diff():
+    """tree_diff agrees with git diff-tree and never reads unchanged subtrees"""
+    path = make_branches()
+    try:
+        r = repo.GitRepository(path)
+        old, new = tree_of(path, "master"), tree_of(path, "feature")
+
+        changes = list(tree_diff(r, old, new))
+        ours = "".join(f"{change_status(a, b)}\t{p}\n" for p, a, b in changes)
+        assert ours == run_git(path, "diff-tree", "-r", "--name-status", old, new)
+        top = [p for p, _, _ in tree_diff(r, old, new, recursive=False)]
+        assert top == run_git(path, "diff-tree", "--name-only", old, new).split()
+
+        shared = run_git(path, "rev-parse", "master:shared").strip()
+        r.object_cache.clear()
+        list(tree_diff(r, old, new))
+        assert shared not in r.object_cache
+
+        # Empty blobs: a file added empty and a file emptied
+        write(path, "empty", "")
+        write(path, "shared/file1.txt", "")
+        run_git(path, "add", "-A")
+        run_git(path, "commit", "-q", "-m", "empty files")
+        old, new = tree_of(path, "HEAD~1"), tree_of(path, "HEAD")
+        stats = diff_stat_format(diff_stat(r, tree_diff(r, old, new)))
+        assert stats == run_git(path, "diff-tree", "--stat", old, new)
+        print("✓ tree_diff matches git diff-tree and skips identical subtrees")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_status():
+    """status reports the same changes as git status, serially or in parallel"""
+    path = make_branches()
+    try:
+        write(path, "src/main.py", "edited\n")
+        write(path, "shared/file3.txt", "staged\n")
+        run_git(path, "add", "shared/file3.txt")
+        os.unlink(os.path.join(path, "run.sh"))
+        write(path, "untracked/deep/file", "new\n")
+        write(path, "src/new.py", "new\n")
+        # Same content, new mtime: must be hashed, not reported
+        os.utime(os.path.join(path, "shared", "file4.txt"))
+        # Mode-only changes, unstaged and staged
+        os.chmod(os.path.join(path, "shared", "file5.txt"), 0o755)
+        os.chmod(os.path.join(path, "shared", "file6.txt"), 0o755)
+        run_git(path, "add", "shared/file6.txt")
+
+        expected = run_git(path, "status", "--porcelain")
+        for workers in (1, 4):
+            r = repo.GitRepository(path)
+            r.status_workers = workers
+            index = index_read(r)
+            head = tree_of(path, "HEAD")
+            assert format_short(*worktree_status(r, index, head)) == expected
+        print("✓ status matches git status --porcelain")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    test_checkout_touches_only_changes()
+    test_checkout_refuses_local_changes()
+    test_parallel_checkout()
+    test_checkout_commit_round_trip()
+    test_tree_diff()
+    test_status()
+    print("Test completed.")
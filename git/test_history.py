@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import tempfile
+import repo
+from testutil import run_git
+from base import object_read
+from log_format import LogFormatter
+from object import GitCommit
+from commit_graph import commit_graph_write, commit_info, repo_commit_graph
+from revwalk import parse_date, rev_walk
+
+
+def commit_file(path, name, message):
+    with open(os.path.join(path, name), "w") as f:
+        f.write(message + "\n")
+    run_git(path, "add", name)
+    run_git(path, "commit", "-q", "-m", message)
+
+
+def make_merge_repo():
+    """Create a history with a merge and an octopus merge using real git"""
+    path = tempfile.mkdtemp(prefix="wyag-history-")
+    run_git(path, "init", "-q", "-b", "master")
+    run_git(path, "config", "user.email", "test@example.com")
+    run_git(path, "config", "user.name", "Test User")
+
+    for i in range(1, 4):
+        commit_file(path, "main.txt", f"main {i}")
+    for branch in ["a", "b", "c"]:
+        run_git(path, "checkout", "-q", "-b", branch, "master~1")
+        commit_file(path, f"{branch}.txt", f"branch {branch}")
+    run_git(path, "checkout", "-q", "master")
+    run_git(path, "merge", "-q", "--no-edit", "a")
+    run_git(path, "merge", "-q", "--no-edit", "b", "c")
+    commit_file(path, "main.txt", "main 4")
+    return path
+
+
+def test_commit_graph():
+    """Our commit-graph passes git's verification and answers parent queries"""
+    path = make_merge_repo()
+    try:
+        r = repo.GitRepository(path)
+        tips = run_git(path, "rev-parse", "master", "a", "b", "c").split()
+        count = commit_graph_write(r, tips)
+        assert count == len(run_git(path, "rev-list", "--all").split())
+
+        run_git(path, "commit-graph", "verify")
+        graph_path = r.repo_path("objects", "info", "commit-graph")
+        assert os.stat(graph_path).st_mode & 0o777 == 0o444
+
+        for line in run_git(path, "rev-list", "--all", "--parents").splitlines():
+            sha, *parents = line.split()
+            assert commit_info(r, sha)[0] == parents, sha
+        assert repo_commit_graph(r) is not None
+        print(f"✓ commit-graph with {count} commits verified by git")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_rev_walk():
+    """The revision walk visits the same commits as git rev-list"""
+    path = make_merge_repo()
+    try:
+        r = repo.GitRepository(path)
+
+        def git_list(*args):
+            return set(run_git(path, "rev-list", *args).split())
+
+        full = list(rev_walk(r, ["master"]))
+        assert len(full) == len(set(full))
+        assert set(full) == git_list("master")
+
+        # Children always come before their parents
+        position = {sha: i for i, sha in enumerate(full)}
+        for sha in full:
+            assert all(position[p] > position[sha] for p in commit_info(r, sha)[0])
+
+        assert list(rev_walk(r, ["master"], max_count=3)) == full[:3]
+        assert set(rev_walk(r, ["a..master"])) == git_list("a..master")
+        assert set(rev_walk(r, ["master", "^b"])) == git_list("master", "^b")
+        assert set(rev_walk(r, ["master"], first_parent=True)) == git_list("--first-parent", "master")
+        assert set(rev_walk(r, ["b..master"], first_parent=True)) == git_list("--first-parent", "b..master")
+        assert list(rev_walk(r, ["master"], since=parse_date("1 day ago"))) == full
+        assert list(rev_walk(r, ["master"], until=parse_date("1 day ago"))) == []
+
+        # Same answers when parents come from the commit-graph
+        commit_graph_write(r, [r.ref_resolve("master")])
+        assert list(rev_walk(r, ["master"])) == full
+        print(f"✓ revision walk over {len(full)} commits matches git rev-list")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_log_format():
+    """--format templates render the same fields as git log"""
+    path = make_merge_repo()
+    try:
+        r = repo.GitRepository(path)
+        template = "%H %h [%P] [%p] %an <%ae> %at %cn %ct %T %t %s%n%b"
+        formatter = LogFormatter(template)
+        assert formatter.needs_commit
+        assert not LogFormatter("%H %P").needs_commit
+
+        expected = run_git(path, "log", f"--format={template}", "--date-order")
+        rendered = ""
+        for sha in rev_walk(r, ["master"]):
+            rendered += formatter.render(sha, commit_info(r, sha)[0], object_read(r, sha))
+        assert sorted(rendered.splitlines()) == sorted(expected.splitlines())
+        print("✓ --format output matches git log")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_commit_headers():
+    """Multi-line headers parse and serialize back to the same bytes"""
+    path = make_merge_repo()
+    try:
+        r = repo.GitRepository(path)
+        head = run_git(path, "cat-file", "commit", "HEAD")
+        signature = "-----BEGIN PGP SIGNATURE-----\n\niQEzBAAB\n-----END PGP SIGNATURE-----"
+        headers, message = head.split("\n\n", 1)
+        signed = headers + "\ngpgsig " + signature.replace("\n", "\n ") + "\n\n" + message
+        sha = subprocess.run(
+            ["git", "-C", path, "hash-object", "-t", "commit", "-w", "--stdin"],
+            input=signed.encode(), capture_output=True, check=True,
+        ).stdout.decode().strip()
+
+        commit = object_read(r, sha)
+        assert commit.parents == [run_git(path, "rev-parse", "HEAD~1").strip()]
+        assert commit.header("gpgsig") == signature
+        assert commit.message == message
+        assert commit.serialize() == signed.encode()
+
+        # Decoding everything and writing it again gives the same commit
+        copy = GitCommit(r)
+        copy.kvlm = dict(commit.kvlm)
+        assert copy.serialize() == signed.encode()
+
+        merge = object_read(r, run_git(path, "rev-parse", "HEAD~1").strip())
+        assert len(merge.parents) == 3
+        print("✓ Commit headers, including gpgsig, round-trip")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    test_commit_graph()
+    test_rev_walk()
+    test_log_format()
+    test_commit_headers()
+    print("Test completed.")
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import base
+import repo
+from testutil import run_git
+from base import object_read, object_write_file
+from object import ObjectId
+from index import index_read, index_write
+from commands.add import add_paths
+from commands.write_tree import write_tree
+
+
+def make_worktree():
+    """Create a repository with a few files whose mtimes lie in the past"""
+    path = tempfile.mkdtemp(prefix="wyag-index-")
+    r = repo.repo_create(path)
+    os.makedirs(os.path.join(path, "src", "lib"))
+    for name in ["README", "src/main.py", "src/lib/util.py"]:
+        full_path = os.path.join(path, name)
+        with open(full_path, "w") as f:
+            f.write(f"contents of {name}\n")
+        # Old mtimes keep the entries from looking racily clean
+        os.utime(full_path, (1000000000, 1000000000))
+    return r, path
+
+
+def test_index_git_compatible():
+    """Real git reads our index, and we read the index real git writes"""
+    r, path = make_worktree()
+    try:
+        index = index_read(r)
+        add_paths(r, index, [os.path.join(path, "src")])
+        index_write(r, index)
+
+        staged = run_git(path, "ls-files", "-s")
+        assert "src/lib/util.py" in staged and "src/main.py" in staged
+        assert "README" not in staged
+
+        run_git(path, "add", "README")
+        entries = index_read(r).entries
+        assert sorted(entries) == ["README", "src/lib/util.py", "src/main.py"]
+        assert entries["README"].sha == run_git(path, "hash-object", "README").strip()
+        print("✓ Index is readable by git and vice versa")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_add_modes_and_symlinks():
+    """add stages symlinks as links and keeps the executable bit, like git add"""
+    path = tempfile.mkdtemp(prefix="wyag-add-")
+    try:
+        # A config written by git, with core.fileMode on
+        run_git(path, "init", "-q")
+        os.makedirs(os.path.join(path, "dir"))
+        for name in ["run.sh", "dir/file"]:
+            with open(os.path.join(path, name), "w") as f:
+                f.write(f"{name}\n")
+        os.chmod(os.path.join(path, "run.sh"), 0o755)
+        os.symlink("run.sh", os.path.join(path, "link"))
+        os.symlink("missing", os.path.join(path, "dangling"))
+        os.symlink("dir", os.path.join(path, "dirlink"))
+
+        r = repo.GitRepository(path)
+        index = index_read(r)
+        add_paths(r, index, [os.path.join(path, "dangling"), path])
+        index_write(r, index)
+        status = run_git(path, "status", "--porcelain").splitlines()
+        assert len(status) == 5 and all(line.startswith("A  ") for line in status), status
+        ours = run_git(path, "ls-files", "-s")
+        run_git(path, "add", "-A")
+        assert ours == run_git(path, "ls-files", "-s")
+
+        # A mode change alone is staged too
+        os.chmod(os.path.join(path, "run.sh"), 0o644)
+        index = index_read(r)
+        add_paths(r, index, [os.path.join(path, "run.sh")])
+        index_write(r, index)
+        assert run_git(path, "ls-files", "-s", "run.sh").startswith("100644 ")
+        print("✓ add stages symlinks and file modes like git")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_write_tree_uses_stat_cache():
+    """A second write_tree with no changes doesn't touch the index at all"""
+    r, path = make_worktree()
+    try:
+        first = write_tree(r, path)
+        listed = run_git(path, "ls-tree", "-r", "--name-only", first).split()
+        assert listed == ["README", "src/lib/util.py", "src/main.py"]
+
+        index_path = r.repo_path("index")
+        before = os.stat(index_path).st_mtime_ns
+        assert write_tree(r, path) == first
+        assert os.stat(index_path).st_mtime_ns == before
+
+        with open(os.path.join(path, "src", "main.py"), "a") as f:
+            f.write("changed\n")
+        second = write_tree(r, path)
+        assert second != first
+        assert index_read(r).entries["src/main.py"].size == len("contents of src/main.py\nchanged\n")
+        print("✓ Unchanged files are served from the stat cache")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_parallel_write_tree():
+    """Hashing on a worker pool produces the same tree as hashing serially"""
+    r, path = make_worktree()
+    try:
+        serial = write_tree(r, path)
+        os.unlink(r.repo_path("index"))
+        r.write_workers = 4
+        assert write_tree(r, path) == serial
+        print("✓ Parallel write_tree is deterministic")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_cache_tree():
+    """write_tree records directory SHAs that are invalidated along a path"""
+    r, path = make_worktree()
+    try:
+        root_sha = write_tree(r, path)
+        tree = index_read(r).cache_tree
+        assert tree.sha == root_sha and tree.entry_count == 3
+        assert tree.children["src"].entry_count == 2
+        lib_sha = tree.children["src"].children["lib"].sha
+        assert lib_sha == run_git(path, "rev-parse", f"{root_sha}:src/lib").strip()
+
+        # Real git trusts the extension and reproduces our root tree
+        assert run_git(path, "write-tree").strip() == root_sha
+
+        with open(os.path.join(path, "src", "main.py"), "a") as f:
+            f.write("changed\n")
+        index = index_read(r)
+        add_paths(r, index, [os.path.join(path, "src", "main.py")])
+        assert index.cache_tree.sha is None
+        assert index.cache_tree.children["src"].sha is None
+        assert index.cache_tree.children["src"].children["lib"].sha == lib_sha
+        print("✓ Cache-tree is invalidated only along the changed path")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_tree_codec():
+    """Trees round-trip byte for byte and are ordered and searched like git's"""
+    r, path = make_worktree()
+    try:
+        # "src" sorts after "src.txt" and "src-1" because git compares it as "src/"
+        for name in ["src.txt", "src-1", "src0"]:
+            with open(os.path.join(path, name), "w") as f:
+                f.write(name)
+        sha = write_tree(r, path)
+        order = run_git(path, "ls-tree", "--name-only", sha).split()
+        assert order == ["README", "src-1", "src.txt", "src", "src0"]
+        assert object_read(r, sha).find("src0")[1] == "src0"
+
+        run_git(path, "add", "-A")
+        assert run_git(path, "write-tree").strip() == sha
+        # Read git's copy fresh rather than the tree write_tree just built
+        r.object_cache.clear()
+        theirs = object_read(r, sha)
+        raw = bytes(theirs.data)
+        assert [item[1] for item in theirs] == order
+        assert theirs.serialize() == raw
+        assert theirs.find("src")[0] == "40000"
+        assert theirs.find("src.txt")[1] == "src.txt"
+        assert theirs.find("missing") is None
+        # Materialised entries serialize back to the same bytes
+        assert len(theirs.items) == 5 and theirs.serialize() == raw
+        try:
+            theirs.items.append(("100644", "new", "0" * 40))
+            assert False, "items should not be mutable"
+        except AttributeError:
+            pass
+
+        # Entries live in parallel arrays: one bytearray holds every SHA
+        assert not hasattr(theirs, "__dict__")
+        assert len(theirs.shas) == 20 * len(theirs.names) == 100
+        mode, name, oid = next(theirs.entries())
+        assert isinstance(oid, ObjectId) and len(oid) == 20
+        assert str(oid) == theirs.entry(0)[2] == run_git(path, "rev-parse", f"{sha}:README").strip()
+        assert theirs.oid(3) == ObjectId.from_hex(theirs.find("src")[2])
+        assert theirs.modes[0] is theirs.modes[1]
+        print("✓ Tree codec round-trips and matches git ordering")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_loose_object_writes():
+    """Existing objects are not rewritten, and directories sync once per batch"""
+    r, path = make_worktree()
+    synced = []
+    fsync_dir = base.fsync_dir
+    base.fsync_dir = lambda dir_path: synced.append(dir_path) or fsync_dir(dir_path)
+    try:
+        root_sha = write_tree(r, path)
+        assert len(synced) == len(set(synced))
+        objects = {}
+        for root, _, files in os.walk(r.repo_path("objects")):
+            for name in files:
+                assert not name.startswith("tmp_obj_")
+                full_path = os.path.join(root, name)
+                objects[full_path] = os.stat(full_path).st_ino
+                assert os.stat(full_path).st_mode & 0o777 == 0o444
+        assert len(objects) == 6
+        run_git(path, "fsck", "--strict", "--no-progress")
+
+        # Without the stat cache everything is rehashed, but nothing is written
+        os.unlink(r.repo_path("index"))
+        assert write_tree(r, path) == root_sha
+        for full_path, inode in objects.items():
+            assert os.stat(full_path).st_ino == inode
+
+        # Objects that only live in a pack are not written loose either
+        run_git(path, "add", "-A")
+        run_git(path, "-c", "user.name=T", "-c", "user.email=t@example.com", "commit", "-q", "-m", "m")
+        run_git(path, "gc", "-q")
+        r = repo.GitRepository(path)
+        sha = object_write_file(r, os.path.join(path, "README"))
+        assert not os.path.exists(r.repo_path("objects", sha[:2], sha[2:]))
+        print("✓ Loose objects are written once, atomically")
+    finally:
+        base.fsync_dir = fsync_dir
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    test_index_git_compatible()
+    test_add_modes_and_symlinks()
+    test_write_tree_uses_stat_cache()
+    test_parallel_write_tree()
+    test_cache_tree()
+    test_tree_codec()
+    test_loose_object_writes()
+    print("Test completed.")
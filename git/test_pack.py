@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import subprocess
+import sys
+import shutil
+import tempfile
+import time
+import pack
+import repo
+from testutil import run_git_raw
+from base import object_read, object_read_raw, object_write, object_write_file, object_header, object_stream
+from object import GitBlob
+from commands.cat_file import cat_file_batch
+from commands.gc import repack, prune_packed, loose_objects
+
+
+def make_packed_repo():
+    """Create a repository with real git whose objects all live in a pack"""
+    path = tempfile.mkdtemp(prefix="wyag-pack-")
+    run_git_raw(path, "init", "-q")
+    run_git_raw(path, "config", "user.email", "test@example.com")
+    run_git_raw(path, "config", "user.name", "Test User")
+
+    # Growing versions of the same file give git something to deltify
+    for i in range(1, 21):
+        with open(os.path.join(path, "numbers.txt"), "w") as f:
+            f.write("\n".join(str(n) for n in range(i * 40)))
+        os.makedirs(os.path.join(path, "sub"), exist_ok=True)
+        with open(os.path.join(path, "sub", f"file{i}.txt"), "w") as f:
+            f.write(f"file {i}\n")
+        run_git_raw(path, "add", "-A")
+        run_git_raw(path, "commit", "-q", "-m", f"Commit {i}")
+
+    run_git_raw(path, "gc", "-q", "--aggressive")
+    return path
+
+
+def test_pack_read():
+    """Every object of a gc'd repository can be read through the packs"""
+    path = make_packed_repo()
+    try:
+        r = repo.GitRepository(path)
+        # Concurrent readers must never see a partly filled pack list
+        pack_file = pack.PackFile
+        pack.PackFile = lambda pack_path: r.packs is None and pack_file(pack_path)
+        try:
+            assert len(pack.repo_packs(r)) == 1 and r.packs[0]
+        finally:
+            pack.PackFile = pack_file
+        objects = run_git_raw(path, "rev-list", "--objects", "--all").decode().splitlines()
+
+        for line in objects:
+            sha = line.split()[0]
+            fmt, data = object_read_raw(r, sha)
+            expected_fmt = run_git_raw(path, "cat-file", "-t", sha).strip()
+            assert fmt == expected_fmt, f"{sha}: {fmt} != {expected_fmt}"
+            assert data == run_git_raw(path, "cat-file", expected_fmt.decode(), sha), sha
+
+            # Header-only and streaming reads agree with the full read
+            assert object_header(r, sha) == (fmt, len(data)), sha
+            stream = object_stream(r, sha, chunk_size=100)
+            assert next(stream) == (fmt, len(data)), sha
+            assert b"".join(stream) == data, sha
+
+        head = run_git_raw(path, "rev-parse", "HEAD").decode().strip()
+        commit = object_read(r, head)
+        assert commit.kvlm["_message"].strip() == "Commit 20"
+        print(f"✓ Read {len(objects)} packed objects")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_gc_round_trip():
+    """Objects packed by gc read back identically and pass git verify-pack"""
+    path = tempfile.mkdtemp(prefix="wyag-gc-")
+    try:
+        r = repo.repo_create(path)
+        written = {}
+        for i in range(1, 11):
+            blob = GitBlob(r, "\n".join(str(n) for n in range(i * 200)).encode())
+            written[object_write(blob)] = blob.blobdata
+
+        synced = []
+        fsync_dir = pack.fsync_dir
+        pack.fsync_dir = lambda dir_path: synced.append(dir_path) or fsync_dir(dir_path)
+        try:
+            pack_name, shas = repack(r)
+        finally:
+            pack.fsync_dir = fsync_dir
+        # The new pack is durable before any loose copy goes
+        assert synced == [r.repo_path("objects", "pack")]
+        prune_packed(r, shas)
+        assert sorted(shas) == sorted(written)
+        assert loose_objects(r) == []
+
+        for sha, data in written.items():
+            assert object_read(r, sha).blobdata == data, sha
+
+        pack_path = os.path.join(r.repo_path("objects", "pack"), f"pack-{pack_name}.idx")
+        output = run_git_raw(path, "verify-pack", "-v", pack_path).decode()
+        assert "chain length" in output, "expected some objects to be deltified"
+        print(f"✓ Packed {len(shas)} objects into pack-{pack_name}")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_compression_levels():
+    """core.compression settings are honoured and compressed data is stored as is"""
+    path = tempfile.mkdtemp(prefix="wyag-zlib-")
+    try:
+        # A config written by git throughout, so later git config calls parse
+        run_git_raw(path, "init", "-q")
+        r = repo.GitRepository(path)
+        text = "".join(f"line {n}\n" for n in range(20000)).encode()
+        noise = os.urandom(512 * 1024)
+        png = b"\x89PNG\r\n\x1a\n" + bytes(20000)
+
+        def stored(data):
+            name = os.path.join(path, "data")
+            with open(name, "wb") as f:
+                f.write(data)
+            sha = object_write_file(r, name)
+            with open(r.repo_path("objects", sha[:2], sha[2:]), "rb") as f:
+                raw = f.read()
+            assert run_git_raw(path, "cat-file", "blob", sha) == data
+            os.unlink(r.repo_path("objects", sha[:2], sha[2:]))
+            return raw
+
+        # zlib records the level class in the second header byte
+        assert stored(text)[1] == 0x01
+        assert len(stored(noise)) > len(noise)
+        assert len(stored(png)) > len(png)
+
+        run_git_raw(path, "config", "core.compression", "9")
+        r = repo.GitRepository(path)
+        assert (r.loose_compression, r.pack_compression) == (9, 9)
+        assert stored(text)[1] == 0xda
+
+        run_git_raw(path, "config", "core.looseCompression", "0")
+        r = repo.GitRepository(path)
+        assert len(stored(text)) > len(text)
+        assert r.pack_compression == 9
+
+        run_git_raw(path, "config", "core.compression", "12")
+        try:
+            repo.GitRepository(path)
+            assert False, "an invalid level should be refused"
+        except Exception as e:
+            assert "compression level" in str(e)
+        print("✓ Compression levels follow the config")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_delta_limit():
+    """delta_create gives up once a delta outgrows max_size"""
+    base = os.urandom(1 << 20)
+    target = bytearray(base)
+    target[1000:1010] = b"x" * 10
+    full = pack.delta_create(base, bytes(target))
+    assert len(full) < 1000
+    assert pack.delta_create(base, bytes(target), len(full) + 1) == full
+    assert pack.delta_create(base, bytes(target), len(full)) is None
+
+    # Two unrelated blobs stop within the first max_size bytes of the target
+    noise = os.urandom(1 << 20)
+    start = time.perf_counter()
+    assert pack.delta_create(base, noise, len(noise) // 2) is None
+    assert time.perf_counter() - start < 1
+    print("✓ Deltas stop at max_size")
+
+
+def test_cat_file_batch():
+    """cat-file --batch and --batch-check answer exactly like git"""
+    path = make_packed_repo()
+    try:
+        r = repo.GitRepository(path)
+        objects = [line.split()[0] for line in run_git_raw(path, "rev-list", "--objects", "--all").decode().splitlines()]
+        requests = "\n".join(objects[:10] + ["HEAD", "0" * 40, "no-such-ref"]) + "\n"
+
+        for option, contents in (("--batch-check", False), ("--batch", True)):
+            expected = subprocess.run(
+                ["git", "-C", path, "cat-file", option], input=requests.encode(),
+                stdout=subprocess.PIPE, check=True,
+            ).stdout
+            out = io.BytesIO()
+            cat_file_batch(r, requests.splitlines(True), out, contents=contents)
+            assert out.getvalue() == expected, option
+
+        # A reader that stops early ends the command without a traceback
+        wyag = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wyag.py")
+        with open(os.path.join(path, "requests"), "wb") as f:
+            f.write(("\n".join(objects) + "\n").encode() * 50)
+        with open(os.path.join(path, "requests"), "rb") as f:
+            proc = subprocess.Popen(
+                [sys.executable, wyag, "cat-file", "--batch"], cwd=path,
+                stdin=f, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+        proc.stdout.readline()
+        proc.stdout.close()
+        assert proc.wait() == 0
+        assert b"Traceback" not in proc.stderr.read()
+        proc.stderr.close()
+
+        # Single objects resolve ref names too, and unknown names are errors
+        for ours, theirs in ((["-t"], ["-t"]), (["-s"], ["-s"]), ([], ["commit"])):
+            output = subprocess.run([sys.executable, wyag, "cat-file"] + ours + ["HEAD"], cwd=path,
+                                    capture_output=True, check=True).stdout
+            assert output == run_git_raw(path, "cat-file", *theirs, "HEAD"), theirs
+        proc = subprocess.run([sys.executable, wyag, "cat-file", "-t", "no-such-ref"], cwd=path,
+                              capture_output=True, text=True)
+        assert proc.stderr == "Error: Object no-such-ref not found\n", proc.stderr
+        print("✓ cat-file --batch matches git")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    test_pack_read()
+    test_gc_round_trip()
+    test_delta_limit()
+    test_cat_file_batch()
+    test_compression_levels()
+    print("Test completed.")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import repo
+from testutil import run_git
+from refs import NULL_SHA, RefTransaction, pack_refs
+from reflog import _lines_reversed, reflog_entries, reflog_expire, reflog_path
+
+
+def make_refs_repo():
+    """A repository with a few commits, branches and tags, partly packed"""
+    path = tempfile.mkdtemp(prefix="wyag-refs-")
+    run_git(path, "init", "-q", "-b", "master")
+    run_git(path, "config", "user.email", "test@example.com")
+    run_git(path, "config", "user.name", "Test User")
+    for i in range(3):
+        run_git(path, "commit", "-q", "--allow-empty", "-m", f"commit {i}")
+        run_git(path, "branch", f"ci/build-{i}")
+        run_git(path, "tag", f"v{i}")
+    run_git(path, "tag", "-a", "-m", "annotated", "release")
+    run_git(path, "pack-refs", "--all")
+    # Loose refs on top of the packed ones, one of them shadowing a packed ref
+    run_git(path, "branch", "loose")
+    run_git(path, "branch", "-f", "ci/build-0", "HEAD~2")
+    return path
+
+
+def show_ref(path):
+    return run_git(path, "show-ref")
+
+
+def test_packed_refs():
+    """Loose and packed refs list and resolve exactly as git sees them"""
+    path = make_refs_repo()
+    try:
+        r = repo.GitRepository(path)
+        expected = show_ref(path)
+        ours = "".join(f"{r.ref_resolve(ref)} {ref}\n" for ref in r.ref_list())
+        assert ours == expected
+        assert r.ref_list("refs/heads") == [
+            "refs/heads/ci/build-0", "refs/heads/ci/build-1",
+            "refs/heads/ci/build-2", "refs/heads/loose", "refs/heads/master",
+        ]
+        assert r.ref_resolve("ci/build-0") == run_git(path, "rev-parse", "HEAD~2").strip()
+        assert r.ref_resolve("v1") == run_git(path, "rev-parse", "v1").strip()
+        assert r.ref_read("refs/heads/missing") is None
+
+        # Changes made by git behind our back are picked up by the same handle
+        run_git(path, "branch", "later")
+        run_git(path, "branch", "-D", "ci/build-1")
+        assert "refs/heads/later" in r.ref_list()
+        assert "refs/heads/ci/build-1" not in r.ref_list()
+
+        # Deleting a packed ref rewrites packed-refs
+        r.ref_delete("refs/tags/v2")
+        assert "refs/tags/v2" not in show_ref(path)
+        print("✓ Packed and loose refs match git show-ref")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_pack_refs():
+    """pack-refs writes a packed-refs file git reads back unchanged"""
+    path = make_refs_repo()
+    try:
+        r = repo.GitRepository(path)
+        expected = show_ref(path)
+
+        pack_refs(r)
+        assert show_ref(path) == expected
+        # By default only tags and already packed refs move
+        assert os.path.exists(os.path.join(path, ".git", "refs", "heads", "loose"))
+        assert not os.path.exists(os.path.join(path, ".git", "refs", "heads", "ci", "build-0"))
+
+        # A ref locked by a transaction stays out, as may one being deleted
+        lock = os.path.join(path, ".git", "refs", "heads", "loose.lock")
+        open(lock, "w").close()
+        pack_refs(r, all_refs=True)
+        assert "refs/heads/loose" not in r.packed_refs()
+        assert r.loose_refs() == {"refs/heads/loose"}
+        os.unlink(lock)
+
+        pack_refs(r, all_refs=True)
+        assert show_ref(path) == expected
+        assert r.loose_refs() == set()
+        assert os.path.isdir(os.path.join(path, ".git", "refs", "heads"))
+        assert run_git(path, "symbolic-ref", "HEAD").strip() == "refs/heads/master"
+        assert r.ref_resolve("HEAD") == run_git(path, "rev-parse", "HEAD").strip()
+        run_git(path, "fsck", "--no-progress")
+        print("✓ pack-refs output is read back by git unchanged")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_ref_transaction():
+    """Transactions apply all updates or none, and refuse stale old values"""
+    path = make_refs_repo()
+    try:
+        r = repo.GitRepository(path)
+        head = r.ref_resolve("HEAD")
+        first = r.ref_resolve("v0")
+        expected = show_ref(path)
+
+        # One stale expectation rejects the whole batch
+        transaction = RefTransaction(r)
+        transaction.update("refs/heads/new", head, NULL_SHA)
+        transaction.update("refs/heads/master", first, first)
+        try:
+            transaction.commit()
+            assert False, "stale old value should have been refused"
+        except Exception as e:
+            assert "refs/heads/master" in str(e)
+        assert show_ref(path) == expected
+
+        # A held lock stops other writers
+        lock = os.path.join(path, ".git", "refs", "heads", "loose.lock")
+        open(lock, "w").close()
+        try:
+            r.ref_create("refs/heads/loose", first)
+            assert False, "locked ref should have been refused"
+        except Exception as e:
+            assert "loose.lock" in str(e)
+        os.unlink(lock)
+
+        transaction = RefTransaction(r)
+        transaction.update("refs/heads/new", head, NULL_SHA)
+        transaction.update("refs/heads/master", first, head)
+        transaction.delete("refs/tags/v1", r.ref_resolve("v1"))
+        transaction.delete("refs/heads/ci/build-0")
+        transaction.commit()
+        assert run_git(path, "rev-parse", "new", "master").split() == [head, first]
+        refs = show_ref(path)
+        assert "refs/tags/v1" not in refs and "ci/build-0" not in refs
+        assert not os.path.exists(os.path.join(path, ".git", "refs", "heads", "ci", "build-0"))
+        assert not [name for name in os.listdir(os.path.join(path, ".git")) if name.endswith(".lock")]
+        run_git(path, "fsck", "--no-progress")
+        print("✓ Ref transactions are all-or-nothing and compare-and-swap")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_concurrent_ref_updates():
+    """Writers racing on one ref never lose an update"""
+    path = make_refs_repo()
+    try:
+        shas = run_git(path, "rev-list", "HEAD").split()
+        counts = []
+
+        def writer():
+            r = repo.GitRepository(path)
+            done = 0
+            for _ in range(50):
+                current = r.ref_read("refs/heads/counter")
+                step = 0 if current is None else int(current.split("-")[1]) + 1
+                # Store the step count in a fake SHA-like value
+                value = f"{shas[step % len(shas)]}-{step}"
+                transaction = RefTransaction(r)
+                transaction.update("refs/heads/counter", value, current or NULL_SHA)
+                try:
+                    transaction.commit()
+                    done += 1
+                except Exception:
+                    pass
+            counts.append(done)
+
+        threads = [threading.Thread(target=writer) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        final = repo.GitRepository(path).ref_read("refs/heads/counter")
+        assert int(final.split("-")[1]) + 1 == sum(counts)
+        print("✓ Concurrent ref updates are serialized by lock files")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_reflog():
+    """Ref updates are logged the way git logs them, read back newest first"""
+    path = make_refs_repo()
+    try:
+        r = repo.GitRepository(path)
+        shas = run_git(path, "rev-list", "HEAD").split()
+        # Start from logs we wrote ourselves
+        shutil.rmtree(os.path.join(path, ".git", "logs"))
+
+        transaction = RefTransaction(r)
+        transaction.update("refs/heads/master", shas[1], shas[0], "reset: moving to HEAD~1")
+        transaction.commit()
+        r.ref_create("refs/heads/topic", shas[2], "branch: Created from HEAD~2")
+        transaction = RefTransaction(r)
+        transaction.update("HEAD", "ref: refs/heads/topic", message="checkout: moving from master to topic")
+        transaction.commit()
+
+        ours = [f"{new[:7]} HEAD@{{{i}}}: {message}\n"
+                for i, (_, new, _, _, _, message) in enumerate(reflog_entries(r, "HEAD"))]
+        assert "".join(ours) == run_git(path, "reflog", "show", "HEAD")
+        assert run_git(path, "reflog", "show", "topic").startswith(f"{shas[2][:7]} topic@{{0}}: branch")
+        # Tags are not logged unless their log already exists
+        r.ref_create("refs/tags/untracked", shas[0])
+        assert not os.path.exists(reflog_path(r, "refs/tags/untracked"))
+        r.ref_delete("refs/heads/topic")
+        assert not os.path.exists(reflog_path(r, "refs/heads/topic"))
+
+        # Reading backwards works across block boundaries
+        with open(reflog_path(r, "HEAD"), "rb") as f:
+            lines = f.read().splitlines()
+            for block_size in (1, 7, 64):
+                assert list(_lines_reversed(f, block_size)) == lines[::-1]
+        print("✓ Reflogs match git reflog")
+    finally:
+        shutil.rmtree(path)
+
+
+def test_reflog_expire():
+    """expire drops only the entries older than the cutoff"""
+    path = make_refs_repo()
+    try:
+        r = repo.GitRepository(path)
+        log = reflog_path(r, "refs/heads/master")
+        with open(log) as f:
+            lines = f.readlines()
+        # Age the first two entries by a year
+        with open(log, "w") as f:
+            for i, line in enumerate(lines):
+                if i < 2:
+                    header, tab, message = line.partition("\t")
+                    fields = header.split(" ")
+                    fields[-2] = str(int(fields[-2]) - 365 * 86400)
+                    line = " ".join(fields) + tab + message
+                f.write(line)
+
+        cutoff = int(time.time()) - 90 * 86400
+        assert reflog_expire(r, "refs/heads/master", cutoff) == 2
+        with open(log) as f:
+            assert f.readlines() == lines[2:]
+        assert reflog_expire(r, "refs/heads/master", cutoff) == 0
+        assert not os.path.exists(os.path.join(path, ".git", "refs", "heads", "master.lock"))
+        print("✓ reflog expire keeps recent entries")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    test_packed_refs()
+    test_pack_refs()
+    test_ref_transaction()
+    test_concurrent_ref_updates()
+    test_reflog()
+    test_reflog_expire()
+    print("Test completed.")
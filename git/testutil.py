@@ -0,0 +1,11 @@
+import subprocess
+
+
+def run_git_raw(path, *cmd):
+    """Run a git command inside path and return its raw output"""
+    return subprocess.check_output(["git", "-C", path] + list(cmd), stderr=subprocess.DEVNULL)
+
+
+def run_git(path, *cmd):
+    """Run a git command inside path and return its output as text"""
+    return run_git_raw(path, *cmd).decode()
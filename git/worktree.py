@@ -0,0 +1,200 @@
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from base import object_read, object_stream, object_write_file
+from diff import tree_diff
+
+
+MODE_EXECUTABLE = "100755"
+MODE_SYMLINK = "120000"
+MODE_GITLINK = "160000"
+
+
+def file_mode(repo, st, entry):
+    """The index mode of a worktree file, as git chooses it
+
+    Symlinks are 120000. Without core.fileMode the executable bit is not
+    trusted, so regular files keep the mode already in the index.
+    """
+    if stat.S_ISLNK(st.st_mode):
+        return 0o120000
+    if not repo.filemode:
+        if entry is not None and entry.mode in (0o100644, 0o100755):
+            return entry.mode
+        return 0o100644
+    return 0o100755 if st.st_mode & 0o100 else 0o100644
+
+
+def _worktree_matches(repo, index, path, full_path, entry):
+    """True when the file at full_path holds exactly entry's content"""
+    try:
+        st = os.lstat(full_path)
+    except FileNotFoundError:
+        return entry is None
+    if entry is None:
+        return False
+    if index.lookup_clean(path, st) == entry[1]:
+        return True
+    if entry[0] == MODE_SYMLINK:
+        return False
+    return os.path.isfile(full_path) and object_write_file(repo, full_path, actually_write=False) == entry[1]
+
+
+def checkout_check(repo, index, changes):
+    """Raise if applying changes would lose uncommitted work
+
+    Each changed path must either hold the old content, or already hold the
+    new content. Untracked files in the way of new ones count as changes,
+    including files or symlinks where a new file needs a directory.
+    """
+    removed = {path for path, _, after in changes if after is None}
+    conflicts = []
+    parents = _with_parents(os.path.dirname(path) for path, _, after in changes if after is not None)
+    for directory in sorted(parents - removed):
+        try:
+            st = os.lstat(os.path.join(repo.worktree, directory))
+        except (FileNotFoundError, NotADirectoryError):
+            # Missing, or below a conflict already reported
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            conflicts.append(directory)
+
+    for path, before, after in changes:
+        full_path = os.path.join(repo.worktree, path)
+        if not os.path.lexists(full_path):
+            continue
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            # A directory can only give way to a file if everything in it
+            # is being removed
+            if after is not None and any(
+                    p not in removed for p in _files_below(repo.worktree, path)):
+                conflicts.append(path)
+            continue
+        if not (_worktree_matches(repo, index, path, full_path, before)
+                or _worktree_matches(repo, index, path, full_path, after)):
+            conflicts.append(path)
+
+    if conflicts:
+        listing = "\n".join(f"\t{path}" for path in conflicts)
+        raise Exception(
+            "Your local changes to the following files would be overwritten by checkout:\n"
+            f"{listing}\nPlease commit your changes before you switch branches."
+        )
+
+
+def checkout_file(repo, full_path, mode, sha):
+    """Write one blob to full_path; its directory must already exist"""
+    if os.path.lexists(full_path):
+        os.unlink(full_path)
+
+    if mode == MODE_SYMLINK:
+        target = bytes(object_read(repo, sha).blobdata)
+        os.symlink(target, full_path)
+        return
+
+    stream = object_stream(repo, sha)
+    next(stream)
+    with open(full_path, "wb") as f:
+        for chunk in stream:
+            f.write(chunk)
+    if mode == MODE_EXECUTABLE:
+        os.chmod(full_path, 0o755)
+
+
+def checkout_tree(repo, index, old_tree, new_tree):
+    """Make the working tree and index go from old_tree to new_tree
+
+    Only files that differ between the trees are written or deleted, and
+    local changes to them are refused before anything is touched. Written
+    files get fresh stat data in the index so the next write-tree does not
+    hash them again. Returns the number of paths changed.
+    """
+    changes = list(tree_diff(repo, old_tree, new_tree))
+    checkout_check(repo, index, changes)
+
+    removed = [path for path, _, after in changes if after is None]
+    written = [(path, after) for path, _, after in changes if after is not None]
+
+    # Deletions go first so a file can turn into a directory and back
+    emptied = set()
+    for path in removed:
+        full_path = os.path.join(repo.worktree, path)
+        if os.path.islink(full_path) or os.path.isfile(full_path):
+            os.unlink(full_path)
+        index.remove(path)
+        emptied.add(os.path.dirname(path))
+    for directory in sorted(_with_parents(emptied), key=len, reverse=True):
+        try:
+            os.rmdir(os.path.join(repo.worktree, directory))
+        except OSError:
+            pass
+
+    # Then every directory the new files need, each created once
+    for directory in sorted(_with_parents(os.path.dirname(path) for path, _ in written)):
+        full_path = os.path.join(repo.worktree, directory)
+        try:
+            st = os.lstat(full_path)
+        except FileNotFoundError:
+            os.mkdir(full_path)
+            continue
+        # Never follow a symlink here: its target is outside our control
+        if not stat.S_ISDIR(st.st_mode):
+            os.unlink(full_path)
+            os.mkdir(full_path)
+
+    files = []
+    links = []
+    for path, (mode, sha) in written:
+        if mode == MODE_GITLINK:
+            # Submodules are not checked out; leave an empty directory
+            os.makedirs(os.path.join(repo.worktree, path), exist_ok=True)
+        elif mode == MODE_SYMLINK:
+            links.append((path, mode, sha))
+        else:
+            files.append((path, mode, sha))
+
+    # Regular files only depend on their directories, so they can be written
+    # in any order; symlinks follow once every file is in place
+    for (path, mode, sha), st in zip(files, checkout_files(repo, files)):
+        index.update(path, sha, st, mode=int(mode, 8))
+    for path, mode, sha in links:
+        full_path = os.path.join(repo.worktree, path)
+        checkout_file(repo, full_path, mode, sha)
+        index.update(path, sha, os.lstat(full_path), mode=int(mode, 8))
+
+    return len(changes)
+
+
+def checkout_files(repo, files):
+    """Write (path, mode, sha) blobs, returning their lstat results in order
+
+    Inflating and writing release the GIL, so checkout.workers threads
+    keep several files in flight, which matters most on network filesystems.
+    """
+    def write(item):
+        path, mode, sha = item
+        full_path = os.path.join(repo.worktree, path)
+        checkout_file(repo, full_path, mode, sha)
+        return os.lstat(full_path)
+
+    if repo.checkout_workers > 1 and len(files) > 1:
+        with ThreadPoolExecutor(max_workers=repo.checkout_workers) as pool:
+            return list(pool.map(write, files))
+    return [write(item) for item in files]
+
+
+def _files_below(worktree, directory):
+    """Yield worktree-relative paths of the files under a directory"""
+    for root, dirs, files in os.walk(os.path.join(worktree, directory)):
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            yield os.path.relpath(os.path.join(root, name), worktree).replace(os.sep, "/")
+
+
+def _with_parents(directories):
+    """Expand relative directories to include all their ancestors"""
+    result = set()
+    for directory in directories:
+        while directory and directory not in result:
+            result.add(directory)
+            directory = os.path.dirname(directory)
+    return result
@@ -8,7 +8,7 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from repo import GitRepository, repo_create
-from commands import init, cat_file, hash_object, log, commit, ls_tree, write_tree, commit_tree, branch, checkout
+from commands import init, cat_file, hash_object, log, commit, ls_tree, write_tree, commit_tree, branch, checkout, gc, add, commit_graph, diff_tree, status, pack_refs, reflog
 
 
 def main(argv=sys.argv[1:]):
@@ -25,6 +25,13 @@ def main(argv=sys.argv[1:]):
     commit_tree.setup_parser(subparsers)
     branch.setup_parser(subparsers)
     checkout.setup_parser(subparsers)
+    gc.setup_parser(subparsers)
+    add.setup_parser(subparsers)
+    commit_graph.setup_parser(subparsers)
+    diff_tree.setup_parser(subparsers)
+    status.setup_parser(subparsers)
+    pack_refs.setup_parser(subparsers)
+    reflog.setup_parser(subparsers)
 
     args = parser.parse_args(argv)
     if args.command: